@@ -0,0 +1,137 @@
+#!venv/bin/python
+""" Time all build stages on synthetic data
+
+Usage: src/benchmark.py [--langs de en fr] [--vocab-size N] [--output FILE]
+
+Generates raw dbs with `synthetic.make_raw_dbs` in a temporary directory
+and runs process, infer-collect, infer, generic, wdweb and the TEI export
+on them, one stage after another. The duration of each stage is written as
+JSON, so that results of different versions can be compared.
+"""
+import os
+import json
+import time
+import argparse
+import platform
+import tempfile
+from itertools import permutations
+
+SRC_PATH = os.path.dirname(os.path.abspath(__file__))
+
+
+def stages(langs):
+    import manifest
+    import process
+    import infer
+    import generic
+    import wdweb
+    import tei
+
+    pairs = ['{}-{}'.format(*p) for p in permutations(langs, 2)]
+    # Time the actual work, even if the work dir has been used before
+    manifest.force = True
+    wdweb_options = dict(fuzzy='deletion', search_index='fts4',
+                         fts5_detail='full')
+
+    def run_process():
+        for lang in langs + pairs:
+            process.do(lang, only=None, sql=None)
+
+    def run_infer_collect():
+        for pair in pairs:
+            infer.do(pair, sql=None)
+
+    def run_generic():
+        for pair in pairs:
+            generic.do(pair, sql=None, only=None)
+
+    def run_wdweb():
+        for lang in langs + pairs:
+            wdweb.do(lang, only=None, sql=None, **wdweb_options)
+
+    def run_tei():
+        os.makedirs('dictionaries/tei/small', exist_ok=True)
+        for pair in pairs:
+            tei.write_tei_dict(*pair.split('-'))
+
+    return [
+        ('process', run_process),
+        ('infer-collect', run_infer_collect),
+        ('infer', infer.infer),
+        ('generic', run_generic),
+        ('wdweb', run_wdweb),
+        ('tei', run_tei),
+    ]
+
+
+def db_sizes():
+    sizes = {}
+    for dirpath, _, filenames in os.walk('dictionaries'):
+        for f in filenames:
+            path = os.path.join(dirpath, f)
+            sizes[os.path.relpath(path, 'dictionaries')] = \
+                os.path.getsize(path)
+    return sizes
+
+
+def run_benchmark(langs, vocab_size, density, gloss_length, work_dir):
+    import synthetic
+
+    # The stages use paths relative to the repository root
+    os.makedirs(work_dir, exist_ok=True)
+    os.chdir(work_dir)
+    if not os.path.exists('src'):
+        os.symlink(SRC_PATH, 'src')
+
+    start = time.perf_counter()
+    synthetic.make_raw_dbs('dictionaries/raw', langs, vocab_size, density,
+                           gloss_length)
+    results = dict(
+        config=dict(langs=langs, vocab_size=vocab_size, density=density,
+                    gloss_length=gloss_length),
+        platform=dict(python=platform.python_version(),
+                      machine=platform.machine()),
+        generate=time.perf_counter() - start,
+        stages={},
+    )
+    for name, func in stages(langs):
+        print('>>', name, flush=True)
+        start = time.perf_counter()
+        func()
+        results['stages'][name] = time.perf_counter() - start
+    results['sizes'] = db_sizes()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--langs', nargs='+', default=['de', 'en', 'fr'])
+    parser.add_argument('--vocab-size', type=int, default=10000)
+    parser.add_argument('--density', type=float, default=0.5,
+                        help='share of vocables with translations')
+    parser.add_argument('--gloss-length', type=int, default=5,
+                        help='words per gloss')
+    parser.add_argument('--work-dir',
+                        help='keep generated dbs here instead of a temp dir')
+    parser.add_argument('--output', help='write results to this JSON file')
+    args = parser.parse_args()
+    if args.output:
+        args.output = os.path.abspath(args.output)
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        try:
+            results = run_benchmark(
+                args.langs, args.vocab_size, args.density, args.gloss_length,
+                args.work_dir or tmp_dir)
+        finally:
+            os.chdir(cwd)
+
+    print(json.dumps(results['stages'], indent=1))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
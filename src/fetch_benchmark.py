@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+""" Time `get_query` against the local SPARQL stand-in server
+
+Usage: src/fetch_benchmark.py [--rows N] [--page-size N] [--latency S]
+                              [--bandwidth MB/S] [--gzip] [--output FILE]
+
+Starts `sparql.replay_server` in a separate process, so that serving the
+pages does not compete with the fetch for the GIL, and fetches all of its
+rows into a raw db in a temporary directory. Rows per second and the peak
+memory of the fetching process are written as JSON, so that fetch path
+changes can be compared on any machine.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+
+SRC_PATH = os.path.dirname(os.path.abspath(__file__))
+
+
+def start_server(args):
+    cmd = [sys.executable, '-m', 'sparql.replay_server', '--port', '0',
+           '--latency', str(args.latency)]
+    if args.replay:
+        cmd += ['--replay', os.path.abspath(args.replay)]
+    else:
+        cmd += ['--rows', str(args.rows)]
+    if args.bandwidth:
+        cmd += ['--bandwidth', str(args.bandwidth)]
+    if args.gzip:
+        cmd.append('--gzip')
+    server = subprocess.Popen(cmd, cwd=SRC_PATH, stdout=subprocess.PIPE,
+                              universal_newlines=True)
+    # printed once the result set is ready
+    url = server.stdout.readline().strip()
+    if not url:
+        raise Exception('replay server did not start')
+    return server, url
+
+
+def run_benchmark(url, page_size, work_dir):
+    import helper
+    from sparql import queries
+
+    # get_query writes to dictionaries/raw and saves the table definition
+    # to src/sql/sparql, both relative to the working directory
+    os.chdir(work_dir)
+    os.makedirs('src/sql/sparql', exist_ok=True)
+    queries.SERVER = url
+    queries.PAGE_SIZE = page_size
+
+    baseline_memory = helper.peak_memory_mb()
+    start = time.perf_counter()
+    queries.get_query('translation', queries.translation_query['sense'],
+                      from_lang='de', to_lang='en')
+    seconds = time.perf_counter() - start
+    path = 'dictionaries/raw/de-en.sqlite3'
+    conn = queries.sqlite3.connect(path)
+    rows = conn.execute('SELECT count(*) FROM translation').fetchone()[0]
+    conn.close()
+    return dict(
+        rows=rows,
+        seconds=seconds,
+        rows_per_second=rows / seconds,
+        baseline_memory_mb=baseline_memory,
+        peak_memory_mb=helper.peak_memory_mb(),
+        db_size=os.path.getsize(path),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=200000,
+                        help='number of synthetic results')
+    parser.add_argument('--replay', metavar='FILE',
+                        help='serve a response recorded from Virtuoso instead')
+    parser.add_argument('--page-size', type=int, default=50000)
+    parser.add_argument('--latency', type=float, default=0,
+                        help='seconds before each response')
+    parser.add_argument('--bandwidth', type=float,
+                        help='MB per second for each response')
+    parser.add_argument('--gzip', action='store_true',
+                        help='let the server compress its responses')
+    parser.add_argument('--output', help='write results to this JSON file')
+    args = parser.parse_args()
+    if args.output:
+        args.output = os.path.abspath(args.output)
+
+    server, url = start_server(args)
+    cwd = os.getcwd()
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            try:
+                fetch = run_benchmark(url, args.page_size, tmp_dir)
+            finally:
+                os.chdir(cwd)
+    finally:
+        server.terminate()
+        server.wait()
+
+    results = dict(
+        config=dict(rows=args.rows, replay=args.replay,
+                    page_size=args.page_size, latency=args.latency,
+                    bandwidth=args.bandwidth, gzip=args.gzip),
+        platform=dict(python=platform.python_version(),
+                      machine=platform.machine()),
+        fetch=fetch,
+    )
+    print(json.dumps(fetch, indent=1))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
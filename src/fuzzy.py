@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+""" Spelling suggestions without the spellfix1 extension
+
+Uses symmetric deletion: every vocable is stored together with all variants
+that have one character removed. A search term is expanded the same way and
+all vocables sharing at least one variant with it are candidates. This finds
+all vocables within an edit distance of one and most within a distance of
+two, using nothing but plain tables and a primary key lookup.
+"""
+import sys
+import unicodedata
+
+# Longer words are only matched exactly, they create too many postings and
+# are rarely the target of a typo search.
+MAX_WORD_LENGTH = 40
+
+
+def fold(word):
+    return unicodedata.normalize('NFKC', word).casefold()
+
+
+def deletions(word):
+    if len(word) > MAX_WORD_LENGTH:
+        return {word}
+    return {word} | {word[:i] + word[i + 1:] for i in range(len(word))}
+
+
+def levenshtein(a, b):
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != char_b),
+            ))
+        previous = current
+    return previous[-1]
+
+
+def make_fuzzy_index(conn, lang):
+    conn.executescript("""
+        DROP TABLE IF EXISTS main.fuzzy_vocable;
+        CREATE TABLE main.fuzzy_vocable (
+            id integer PRIMARY KEY,
+            written_rep text NOT NULL,
+            folded text NOT NULL,
+            score real NOT NULL
+        );
+        DROP TABLE IF EXISTS main.fuzzy_deletion;
+        CREATE TABLE main.fuzzy_deletion (
+            deletion text NOT NULL,
+            vocable_id int NOT NULL,
+            PRIMARY KEY (deletion, vocable_id)
+        ) WITHOUT ROWID;
+    """)
+    conn.create_function('fold', 1, fold)
+    conn.execute("""
+        INSERT INTO main.fuzzy_vocable(written_rep, folded, score)
+        SELECT written_rep, fold(written_rep), max(score)
+        FROM main.entry
+            JOIN (
+                SELECT substr(vocable, 5) AS written_rep,
+                       rel_score AS score
+                FROM rel_importance
+            ) USING (written_rep)
+        GROUP BY written_rep
+    """)
+    vocables = conn.execute(
+        "SELECT id, folded FROM main.fuzzy_vocable").fetchall()
+    conn.executemany(
+        "INSERT OR IGNORE INTO main.fuzzy_deletion VALUES (?, ?)",
+        ((d, vocable_id)
+         for vocable_id, folded in vocables
+         for d in deletions(folded))
+    )
+
+
+def suggest(conn, term, limit=10, max_distance=2, schema='main'):
+    """ Return [(written_rep, distance, score)] for vocables similar to `term`
+
+    Suggestions are ordered by edit distance first and importance second.
+    """
+    folded_term = fold(term)
+    keys = list(deletions(folded_term))
+    candidates = conn.execute("""
+        SELECT written_rep, folded, score
+        FROM {schema}.fuzzy_vocable
+        WHERE id IN (
+            SELECT vocable_id
+            FROM {schema}.fuzzy_deletion
+            WHERE deletion IN ({params})
+        )
+    """.format(schema=schema, params=', '.join(['?'] * len(keys))), keys)
+    results = []
+    for written_rep, folded, score in candidates:
+        distance = levenshtein(folded_term, folded)
+        if distance <= max_distance:
+            results.append((written_rep, distance, score))
+    results.sort(key=lambda r: (r[1], -r[2]))
+    return results[:limit]
+
+
+def benchmark(lang, samples=1000):
+    """ Compare latency and results with the spellfix1 extension
+
+    Searches for misspelled versions of the most important vocables. Both
+    indexes have to exist in the wdweb db, so build it with both fuzzy index
+    variants first.
+    """
+    import random
+    import time
+    from pysqlite3 import dbapi2 as sqlite3
+
+    conn = sqlite3.connect('dictionaries/wdweb/%s.sqlite3' % lang)
+    conn.enable_load_extension(True)
+    conn.load_extension('lib/spellfix1')
+    words = [w for (w,) in conn.execute("""
+        SELECT written_rep FROM fuzzy_vocable
+        WHERE length(written_rep) > 3
+        ORDER BY score DESC LIMIT ?
+    """, [samples])]
+    rand = random.Random(0)
+
+    def typo(w):
+        i = rand.randrange(len(w))
+        return w[:i] + w[i + 1:] if rand.random() < 0.5 else (
+            w[:i] + rand.choice('aeinrst') + w[i + 1:])
+    terms = [(w, typo(w)) for w in words]
+
+    def spellfix(term):
+        return [w for (w,) in conn.execute("""
+            SELECT word FROM spellfix_entry WHERE word MATCH ? AND top = 10
+        """, [term])]
+
+    def deletion(term):
+        return [w for w, _, _ in suggest(conn, term)]
+
+    for name, func in [('spellfix1', spellfix), ('deletion', deletion)]:
+        timings = []
+        found = 0
+        for word, term in terms:
+            start = time.perf_counter()
+            result = func(term)
+            timings.append(time.perf_counter() - start)
+            found += word in result
+        timings.sort()
+        print('{} {:10} p50 {:7.2f}ms  p99 {:7.2f}ms  recall {:.1%}'.format(
+            lang, name,
+            timings[len(timings) // 2] * 1000,
+            timings[int(len(timings) * 0.99)] * 1000,
+            found / len(terms)))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 3 and sys.argv[1] == 'bench':
+        for lang in sys.argv[2:]:
+            benchmark(lang)
+    else:
+        print('Usage: %s bench LANG...' % sys.argv[0])
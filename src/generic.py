@@ -1,4 +1,4 @@
-from helper import make_targets
+from helper import make_targets, create_aggregate
 from infer import AggByScore
 
 
@@ -44,7 +44,7 @@ def translation(conn, lang):
 
 
 def simple_translation(conn, lang):
-    conn.create_aggregate("agg_by_score", 2, AggByScore)
+    create_aggregate(conn, "agg_by_score", 2, AggByScore)
     conn.execute("""DROP TABLE IF EXISTS simple_translation""")
     conn.execute("""
         CREATE TABLE simple_translation AS
@@ -88,7 +88,7 @@ def do(lang, sql, only, **kwargs):
 def add_subparsers(subparsers):
     process = subparsers.add_parser(
         'generic', help='')
-    process.add_argument('lang')
+    process.add_argument('lang', nargs='+')
     process.set_defaults(func=do)
     process.add_argument('--sql')
     process.add_argument('--only')
@@ -1,12 +1,29 @@
 import os
+import re
 import sys
+import gzip
+import lzma
+import json
+import time
+import datetime
 from itertools import permutations
+from collections import Counter, OrderedDict
+
+import progress
+import manifest
 
 supported_langs = [
     'de', 'en', 'fr', 'pl', 'sv', 'es', 'pt', 'fi', 'el', 'ru', 'tr',
     'bg', 'it', 'ja', 'id', 'nl', 'lt', 'la', 'mg', 'no',
 ]
 
+# Functions opening a file for writing, by compression type. They take the
+# same mode and encoding arguments as `open`.
+compressors = {
+    'gz': gzip.open,
+    'xz': lzma.open,
+}
+
 
 def make_for_langs(functions, langs, **kwargs):
     """ Executes functions for all given languages
@@ -37,19 +54,431 @@ def make_for_lang_permutations(functions, langs, **kwargs):
             func(from_lang, to_lang)
 
 
-def make_targets(lang, out_path, targets, in_path=None, only=None, sql=None,
-                 attach=()):
+# Every target run by `make_targets` is logged here as a JSON line
+BUILD_LOG = 'dictionaries/build_log.jsonl'
+# Add EXPLAIN QUERY PLAN output for the target's statements to the log
+explain_query_plans = False
+
+create_table_as_re = re.compile(
+    r'^CREATE\s+(?:TEMP\s+)?TABLE\s+\S+\s+AS\s+', re.IGNORECASE)
+explainable_re = re.compile(
+    r'^(?:SELECT|WITH|INSERT|UPDATE|DELETE|'
+    r'CREATE\s+(?:TEMP\s+)?TABLE\s+\S+\s+AS)\b',
+    re.IGNORECASE)
+created_table_re = re.compile(
+    r'^CREATE\s+(?:VIRTUAL\s+)?TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?'
+    r'(?:main\.)?(\w+)', re.IGNORECASE)
+# Whitespace and comments in front of a statement. Traced statements from
+# `executescript` start with everything after the previous semicolon.
+leading_comments_re = re.compile(r'(?:\s+|--[^\n]*(?:\n|$)|/\*.*?\*/)*',
+                                 re.DOTALL)
+
+
+def strip_comments(statement):
+    """ Remove leading whitespace and comments from a statement """
+    return statement[leading_comments_re.match(statement).end():]
+
+
+# Set by `run.py --trace-sql` to a SQLTracer
+sql_tracer = None
+# Set by `run.py --profile` and `--trace-sql`
+count_udf_calls = False
+udf_calls = Counter()
+
+
+class SQLTracer:
+    """ Print each SQL statement together with its duration
+
+    The trace callback is only invoked when a statement starts, so the
+    duration is measured until the next statement starts or `flush` is
+    called. Python code running in between is included.
+    """
+
+    def __init__(self, out=sys.stderr):
+        self.out = out
+        self.current = None
+
+    def __call__(self, statement):
+        self.flush()
+        self.current = (statement, time.perf_counter())
+
+    def flush(self):
+        if self.current:
+            statement, start = self.current
+            print('{:9.3f}s  {}'.format(time.perf_counter() - start,
+                                        ' '.join(statement.split())),
+                  file=self.out, flush=True)
+            self.current = None
+
+
+# Set while `PlanCollector` explains a statement, so that the EXPLAIN
+# statements are not passed to the trace callbacks
+explaining = False
+
+
+def trace(conn, *callbacks):
+    """ Set the trace callback to `callbacks` plus the global `sql_tracer`
+
+    A connection only has a single trace callback, so everyone who wants
+    to see the statements has to go through this.
+    """
+    callbacks = [c for c in callbacks + (sql_tracer,) if c]
+    if not callbacks:
+        conn.set_trace_callback(None)
+        return
+
+    def callback(statement):
+        if explaining:
+            return
+        for c in callbacks:
+            c(statement)
+    conn.set_trace_callback(callback)
+
+
+def counted(name, func):
+    def wrapper(*args):
+        udf_calls[name] += 1
+        return func(*args)
+    return wrapper
+
+
+def create_function(conn, name, num_params, func):
+    """ Like conn.create_function, but counts calls if requested """
+    if count_udf_calls:
+        func = counted(name, func)
+    conn.create_function(name, num_params, func)
+
+
+def create_aggregate(conn, name, num_params, aggregate_class):
+    """ Like conn.create_aggregate, but counts steps if requested """
+    if count_udf_calls:
+        aggregate_class = type(aggregate_class.__name__, (aggregate_class,),
+                               dict(step=counted(name, aggregate_class.step)))
+    conn.create_aggregate(name, num_params, aggregate_class)
+
+
+def print_udf_calls(out=sys.stderr):
+    for name, calls in udf_calls.most_common():
+        print('{:>12}  {}'.format(calls, name), file=out)
+
+
+def created_tables(conn, statements):
+    """ Names of the main db tables created by `statements`
+
+    Virtual tables are left out, since some of them, like contentless FTS5
+    tables, can not be scanned to count their rows.
+    """
+    names = set()
+    for statement in statements:
+        match = created_table_re.match(strip_comments(statement))
+        if match:
+            names.add(match.group(1))
+    return sorted(
+        name for name in names
+        if conn.execute("""
+            SELECT 1 FROM main.sqlite_master
+            WHERE type = 'table' AND name = ?
+                AND sql NOT LIKE 'CREATE VIRTUAL%'
+        """, [name]).fetchone()
+    )
+
+
+class PlanCollector:
+    """ Trace callback collecting EXPLAIN QUERY PLAN output
+
+    Each distinct statement is explained when it starts, so that the tables
+    it uses still exist. Temp tables are often dropped before the target
+    finishes.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.plans = []
+        self.seen = set()
+
+    def __call__(self, statement):
+        global explaining
+        if statement in self.seen:
+            return
+        self.seen.add(statement)
+        query = strip_comments(statement)
+        if not explainable_re.match(query):
+            return
+        # Explain the query that fills a new table, not its creation
+        query = create_table_as_re.sub('', query)
+        explaining = True
+        try:
+            plan = [row[-1] for row in
+                    self.conn.execute('EXPLAIN QUERY PLAN ' + query)]
+        except Exception as e:
+            plan = ['error: {}'.format(e)]
+        finally:
+            explaining = False
+        self.plans.append(dict(sql=' '.join(statement.split()), plan=plan))
+
+
+def previous_duration(out_path, lang, name):
+    """ Duration of the target's last run according to the build log """
+    if not os.path.exists(BUILD_LOG):
+        return None
+    duration = None
+    with open(BUILD_LOG) as log:
+        for line in log:
+            record = json.loads(line)
+            if (record['out_path'], record['lang'], record['target']) == \
+                    (out_path, lang, name):
+                duration = record['seconds']
+    return duration
+
+
+def run_target(conn, lang, out_path, name, f):
+    """ Run a single target and append timing and row counts to the log """
+    statements = []
+    sql_progress = progress.watch(
+        conn, '{}/{} {}'.format(out_path, lang, name),
+        previous_duration(out_path, lang, name) if progress.mode else None)
+    plan_collector = PlanCollector(conn) if explain_query_plans else None
+    trace(conn, statements.append, plan_collector, sql_progress)
+    changes = conn.total_changes
+    start = time.perf_counter()
+    f(conn, lang)
+    duration = time.perf_counter() - start
+    if sql_tracer:
+        sql_tracer.flush()
+    if sql_progress:
+        sql_progress.finish()
+    trace(conn)
+
+    record = dict(
+        out_path=out_path,
+        lang=lang,
+        target=name,
+        seconds=round(duration, 3),
+        changes=conn.total_changes - changes,
+        rows={
+            table: conn.execute(
+                'SELECT count(*) FROM main."%s"' % table).fetchone()[0]
+            for table in created_tables(conn, statements)
+        },
+    )
+    staged = [name for _, name, path in conn.execute('PRAGMA database_list')
+              if path.startswith(STAGING_PREFIX)]
+    if staged:
+        record['staged_in_memory'] = staged
+    if plan_collector:
+        record['query_plans'] = plan_collector.plans
+    log_build(record)
+
+
+def log_build(record):
+    """ Append `record` to the build log, together with the build profile """
+    record = dict(
+        time=datetime.datetime.now().isoformat(timespec='seconds'),
+        **record,
+        build_profile=build_profile,
+        peak_memory_mb=peak_memory_mb(),
+    )
+    with open(BUILD_LOG, 'a') as log:
+        log.write(json.dumps(record) + '\n')
+
+
+# Pragmas for all dbs of a build, selected with `run.py --build-profile`.
+# page_size only takes effect for new dbs and after a VACUUM.
+build_profiles = {
+    'default': {},
+    'laptop': dict(
+        cache_size=-256 * 1024,  # KiB
+        temp_store='FILE',
+        mmap_size=0,
+        page_size=4096,
+        journal_mode='MEMORY',
+        synchronous='NORMAL',
+        threads=2,
+    ),
+    'server': dict(
+        cache_size=-4 * 1024 * 1024,  # KiB
+        temp_store='MEMORY',
+        mmap_size=16 * 1024 ** 3,
+        page_size=16384,
+        journal_mode='OFF',
+        synchronous='OFF',
+        threads=8,
+    ),
+}
+build_profile = 'default'
+# These apply to the whole connection, the others to each attached db
+connection_pragmas = {'temp_store', 'threads'}
+# Unsafe for dbs which are not rebuilt on failure, like the inputs or the
+# shared wikdict db, so these are only set for the output db `main`
+output_pragmas = {'journal_mode', 'synchronous'}
+
+
+def apply_build_profile(conn, schemas=('main',)):
+    """ Set the pragmas of the current build profile for `schemas` """
+    for pragma, value in build_profiles[build_profile].items():
+        if pragma in connection_pragmas:
+            if 'main' in schemas:
+                conn.execute('PRAGMA %s = %s' % (pragma, value))
+        else:
+            for schema in schemas:
+                if pragma in output_pragmas and schema != 'main':
+                    continue
+                conn.execute('PRAGMA %s.%s = %s' % (schema, pragma, value))
+
+
+def peak_memory_mb():
+    """ Peak resident memory of this process so far """
+    import resource
+    # ru_maxrss is in KiB on Linux, but in bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(maxrss / (1024 ** 2 if sys.platform == 'darwin' else 1024))
+
+
+# Connections of `make_targets`, kept open for later targets of the same
+# run.py invocation which write to the same db
+MAX_CONNECTIONS = 8
+connections = OrderedDict()
+attach_re = re.compile(r"^'(.*)' AS (\w+)$")
+
+
+def connect(path):
+    """ Return a connection to `path`, reusing an open one if possible """
+    if path in connections:
+        connections.move_to_end(path)
+        return connections[path]
     from pysqlite3 import dbapi2 as sqlite3
+    # uri=True for attaching dbs staged in memory
+    conn = sqlite3.connect(path, uri=True)
+    connections[path] = conn
+    if len(connections) > MAX_CONNECTIONS:
+        connections.popitem(last=False)[1].close()
+    return conn
+
+
+# Input dbs up to this size (in MB) are copied into memory before they are
+# attached. Set by `run.py --stage-in-memory`, 0 disables staging. SQLite
+# limits in-memory dbs to 1 GiB by default.
+memory_staging_limit = 0
+# Total size (in MB) of the staged copies kept for later targets. The
+# least recently used copies are released beyond this.
+MAX_STAGED_MB = 2048
+STAGING_PREFIX = '/wikdict-staged'
+# path -> (mtime and size of the copied file, connection keeping the copy),
+# in the order of their last use
+staged_dbs = OrderedDict()
+
+
+def stage_in_memory(conn, path):
+    """ Copy the db at `path` into memory, return the name of the copy
+
+    The copy uses the memdb VFS, so that other connections of the same
+    process can attach it. It is only copied again if the file changed.
+    """
+    name = STAGING_PREFIX + os.path.realpath(path)
+    stat = os.stat(path)
+    stamp = (stat.st_mtime, stat.st_size)
+    if path in staged_dbs and staged_dbs[path][0] == stamp:
+        staged_dbs.move_to_end(path)
+        return name
+
+    start = time.perf_counter()
+    if path in staged_dbs:
+        holder = staged_dbs[path][1]
+    else:
+        # Use the same SQLite library as `conn`, the copy is not visible
+        # to other copies of the library.
+        holder = type(conn)('file:%s?vfs=memdb' % name, uri=True)
+    source = type(conn)(path)
+    source.backup(holder)
+    source.close()
+    staged_dbs[path] = (stamp, holder)
+    staged_dbs.move_to_end(path)
+    release_staged(keep=path)
+    log_build(dict(out_path=path, lang=None, target='stage_in_memory',
+                   seconds=round(time.perf_counter() - start, 3),
+                   size_mb=round(stat.st_size / 1024 ** 2, 1)))
+    return name
+
+
+def release_staged(keep):
+    """ Close the oldest staged copies while over `MAX_STAGED_MB`
+
+    Connections which still have a copy attached keep it readable until
+    they detach it.
+    """
+    def total_mb():
+        return sum(stamp[1] for stamp, _ in staged_dbs.values()) / 1024 ** 2
+
+    while total_mb() > MAX_STAGED_MB and next(iter(staged_dbs)) != keep:
+        staged_dbs.popitem(last=False)[1][1].close()
+
+
+def attach_db(conn, path, name, stage=False):
+    """ Attach `path` as `name` unless it is attached already
+
+    With `stage`, small dbs are copied into memory first, see
+    `memory_staging_limit`.
+    """
+    if (stage and memory_staging_limit and os.path.exists(path) and
+            os.path.getsize(path) <= memory_staging_limit * 1024 ** 2):
+        target = stage_in_memory(conn, path)
+        uri = 'file:%s?vfs=memdb' % target
+    else:
+        target = os.path.realpath(path)
+        uri = path
+    attached = {row[1]: row[2] for row in conn.execute('PRAGMA database_list')}
+    if name in attached:
+        if os.path.realpath(attached[name]) == target:
+            return
+        conn.execute('DETACH DATABASE ' + name)
+    conn.execute('ATTACH DATABASE ? AS ' + name, [uri])
+
+
+def make_targets(lang, out_path, targets, in_path=None, only=None, sql=None,
+                 attach=(), outputs=(), sources=(), config=None,
+                 check_manifest=True):
+    """ Run `targets` to build the db `out_path`/`lang`
+
+    Unless only some targets are selected, the run is skipped if the
+    attached dbs, the targets' source files plus `sources` and `config`
+    did not change since the last run (see `manifest`). Attached dbs which
+    are only written to are listed by name in `outputs`. Callers which do
+    not build the db, like benchmarks, pass `check_manifest=False`.
+    """
     if out_path.endswith('.sqlite3'):
-        conn = sqlite3.connect('dictionaries/%s' % out_path)
+        out_file = 'dictionaries/%s' % out_path
     else:
         os.makedirs('dictionaries/' + out_path, exist_ok=True)
-        conn = sqlite3.connect('dictionaries/%s/%s.sqlite3' % (out_path, lang))
-    conn.execute("ATTACH DATABASE 'dictionaries/%s/%s.sqlite3' AS %s"
-                 % (in_path, lang, in_path))
-    for a in attach:
-        conn.execute(
-            "ATTACH DATABASE " + a)
+        out_file = 'dictionaries/%s/%s.sqlite3' % (out_path, lang)
+    attached = [('dictionaries/%s/%s.sqlite3' % (in_path, lang), in_path)] + [
+        attach_re.match(a).groups() for a in attach]
+
+    # Dbs shared by several languages have no single set of inputs
+    check_manifest = check_manifest and not (
+        sql or only or out_path.endswith('.sqlite3'))
+    if check_manifest:
+        manifest_conn = manifest.connect()
+        key = manifest.stage_key(
+            manifest_conn,
+            inputs=[path for path, name in attached if name not in outputs],
+            sources=manifest.source_files(
+                {sys.modules[f.__module__] for _, f in targets}
+            ) + [os.path.abspath(s) for s in sources],
+            config=dict(targets=[name for name, _ in targets], config=config),
+        )
+        if manifest.up_to_date(manifest_conn, out_file, key):
+            print('%s/%s: up to date' % (out_path, lang))
+            return
+
+    conn = connect(out_file)
+    trace(conn)
+    # Only inputs shared by several dbs, like processed/<lang> for all
+    # pairs, are worth copying into memory. The db of `in_path` is only
+    # read for this one.
+    for path, name in attached:
+        attach_db(conn, path, name,
+                  stage=name != in_path and name not in outputs)
+    apply_build_profile(conn, ['main'] + [name for _, name in attached])
 
     if sql:
         cur = conn.cursor()
@@ -62,9 +491,11 @@ def make_targets(lang, out_path, targets, in_path=None, only=None, sql=None,
     for name, f in targets:
         if not only or only == name:
             print(name, flush=True, end=' ')
-            f(conn, lang)
+            run_target(conn, lang, out_path, name, f)
     conn.commit()
     print()
+    if check_manifest:
+        manifest.record(manifest_conn, out_file, key)
 
 
 if __name__ == '__main__':
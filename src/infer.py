@@ -1,6 +1,16 @@
+import os
+import time
 import sqlite3
+from itertools import permutations
 
-from helper import make_targets
+from helper import (
+    make_targets, trace, create_aggregate, apply_build_profile, log_build,
+    supported_langs)
+import progress
+import manifest
+
+# The tables of infer.sqlite3 which are used by later stages
+INFER_OUTPUT = ['infer', 'infer_grouped']
 
 
 def collect(conn, lang):
@@ -30,6 +40,30 @@ def collect(conn, lang):
     """, [from_lang, to_lang])
 
 
+def prune(conn):
+    """ Drop translations of pairs which are no longer supported
+
+    infer.sqlite3 is not rebuilt from scratch, so without this, languages
+    removed from `supported_langs` would still be used for inference.
+    """
+    has_all_trans = conn.execute("""
+        SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'all_trans'
+    """).fetchone()
+    if not has_all_trans:
+        return
+    pairs = set(permutations(supported_langs, 2))
+    stale = [pair for pair in conn.execute("""
+                SELECT DISTINCT from_lang, to_lang FROM all_trans
+            """) if pair not in pairs]
+    for from_lang, to_lang in stale:
+        print('infer: removing unsupported pair %s-%s' % (from_lang, to_lang))
+        conn.execute("""
+            DELETE FROM all_trans
+            WHERE from_lang = ? AND to_lang = ?
+        """, [from_lang, to_lang])
+    conn.commit()
+
+
 class AggByScore:
 
     def __init__(self):
@@ -52,9 +86,36 @@ class AggByScore:
 
 
 def infer(**kwargs):
-    conn = sqlite3.connect('dictionaries/infer.sqlite3')
-    conn.create_aggregate("agg_by_score", 2, AggByScore)
+    path = 'dictionaries/infer.sqlite3'
+    conn = sqlite3.connect(path)
+    prune(conn)
+    conn.close()
+
+    # infer-collect writes to the same db, so only compare the tables
+    manifest_conn = manifest.connect()
+    key = manifest.stage_key(
+        manifest_conn,
+        inputs=[(path, ['all_trans'])],
+        sources=[os.path.abspath(__file__), os.path.abspath('src/infer.sql')],
+    )
+    if manifest.up_to_date(manifest_conn, path, key, INFER_OUTPUT):
+        print('infer: up to date')
+        return
+
+    conn = sqlite3.connect(path)
+    apply_build_profile(conn)
+    sql_progress = progress.watch(conn, 'infer')
+    trace(conn, sql_progress)
+    create_aggregate(conn, "agg_by_score", 2, AggByScore)
+    start = time.perf_counter()
     conn.executescript(open('src/infer.sql').read())
+    if sql_progress:
+        sql_progress.finish()
+    conn.commit()
+    conn.close()
+    log_build(dict(out_path='infer.sqlite3', lang=None, target='infer',
+                   seconds=round(time.perf_counter() - start, 3)))
+    manifest.record(manifest_conn, path, key, INFER_OUTPUT)
 
 
 def do(lang, sql, **kwargs):
@@ -76,7 +137,7 @@ def do(lang, sql, **kwargs):
 def add_subparsers(subparsers):
     process = subparsers.add_parser(
         'infer-collect', help='')
-    process.add_argument('lang')
+    process.add_argument('lang', nargs='+')
     process.set_defaults(func=do)
     process.add_argument('--sql')
 
@@ -0,0 +1,144 @@
+""" Skip build stages whose inputs did not change
+
+The Makefile only looks at mtimes, so a raw db which is fetched again with
+identical content causes all downstream stages to be rebuilt. This module
+records a key for each output, which hashes the logical content of the
+input dbs (schema and rows of every table), the source files of the stage
+and its configuration. If the key did not change and the output is still
+the file written by the stage, the stage can be skipped.
+
+Content hashes of input dbs are cached by mtime and size, so that every
+db is only read once after it changed.
+"""
+import os
+import sys
+import json
+import hashlib
+import sqlite3
+
+MANIFEST = 'dictionaries/build_manifest.sqlite3'
+# Set by `run.py --force` to rebuild everything
+force = False
+SRC_PATH = os.path.dirname(os.path.abspath(__file__))
+
+
+def connect():
+    conn = sqlite3.connect(MANIFEST, timeout=60)
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS output (
+            path text PRIMARY KEY,
+            key text NOT NULL,
+            state text NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS content_hash (
+            path text NOT NULL,
+            tables text NOT NULL,
+            mtime real NOT NULL,
+            size int NOT NULL,
+            hash text NOT NULL,
+            PRIMARY KEY (path, tables)
+        );
+    """)
+    return conn
+
+
+def stamp(path):
+    stat = os.stat(path)
+    return stat.st_mtime, stat.st_size
+
+
+def hash_tables(path, tables=None):
+    """ Hash schema and rows of `tables` (default: all tables) """
+    h = hashlib.sha256()
+    conn = sqlite3.connect('file:%s?mode=ro' % path, uri=True)
+    schema = dict(conn.execute("""
+        SELECT name, sql FROM sqlite_master
+        WHERE type = 'table' AND name NOT LIKE 'sqlite_%'
+    """))
+    for table in sorted(tables or schema):
+        h.update(repr((table, schema.get(table))).encode())
+        if table not in schema:
+            continue
+        for row in conn.execute('SELECT * FROM "%s"' % table):
+            h.update(repr(row).encode())
+    conn.close()
+    return h.hexdigest()
+
+
+def content_hash(conn, path, tables=None):
+    """ Cached `hash_tables` """
+    if not os.path.exists(path):
+        return None
+    tables_key = ','.join(sorted(tables or []))
+    mtime, size = stamp(path)
+    row = conn.execute("""
+        SELECT hash FROM content_hash
+        WHERE path = ? AND tables = ? AND mtime = ? AND size = ?
+    """, [path, tables_key, mtime, size]).fetchone()
+    if row:
+        return row[0]
+    content = hash_tables(path, tables)
+    conn.execute("""
+        INSERT OR REPLACE INTO content_hash VALUES (?, ?, ?, ?, ?)
+    """, [path, tables_key, mtime, size, content])
+    conn.commit()
+    return content
+
+
+def source_files(modules):
+    """ Files of `modules` and of the src modules they import from """
+    files = set()
+    for module in modules:
+        files.add(module.__file__)
+        for value in vars(module).values():
+            imported = value if hasattr(value, '__file__') \
+                else sys.modules.get(getattr(value, '__module__', None))
+            path = getattr(imported, '__file__', None)
+            if path and os.path.abspath(path).startswith(SRC_PATH):
+                files.add(path)
+    return sorted(os.path.abspath(f) for f in files)
+
+
+def stage_key(conn, inputs, sources, config=None):
+    """ Hash of everything which influences a stage's output
+
+    `inputs` is a list of db paths or (db path, tables) tuples.
+    """
+    h = hashlib.sha256()
+    for i in inputs:
+        path, tables = i if isinstance(i, tuple) else (i, None)
+        h.update(repr((path, content_hash(conn, path, tables))).encode())
+    for path in sources:
+        with open(path, 'rb') as f:
+            h.update(os.path.relpath(path, SRC_PATH).encode() +
+                     hashlib.sha256(f.read()).digest())
+    h.update(json.dumps(config, sort_keys=True).encode())
+    return h.hexdigest()
+
+
+def output_state(conn, output, tables=None):
+    """ Identifies the current content of `output`
+
+    Without `tables`, the file's mtime and size are used. Pass `tables` for
+    outputs which are also written by other stages.
+    """
+    if tables:
+        return content_hash(conn, output, tables)
+    return repr(stamp(output))
+
+
+def up_to_date(conn, output, key, tables=None):
+    """ Did the stage run with `key` write the current `output`? """
+    if force or not os.path.exists(output):
+        return False
+    return conn.execute("""
+        SELECT 1 FROM output WHERE path = ? AND key = ? AND state = ?
+    """, [output, key, output_state(conn, output, tables)]).fetchone() \
+        is not None
+
+
+def record(conn, output, key, tables=None):
+    conn.execute("""
+        INSERT OR REPLACE INTO output VALUES (?, ?, ?)
+    """, [output, key, output_state(conn, output, tables)])
+    conn.commit()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+""" Create compressed copies of the downloadable dbs and a manifest
+
+Usage: src/package.py [--compress gz|xz] [--jobs JOBS]
+
+Compresses dictionaries/generic/*.sqlite3 and the processed single language
+dbs into dictionaries/download, keeping the layout of the download server.
+Files which are already up to date are not compressed again. The manifest
+lists size and sha256 checksum of every compressed file.
+"""
+import os
+import json
+import shutil
+import hashlib
+import argparse
+from glob import glob
+from concurrent.futures import ProcessPoolExecutor
+
+from helper import supported_langs, compressors
+
+out_dir = 'dictionaries/download'
+
+
+def release_files():
+    """ Yield (input path, path relative to `out_dir`) """
+    for path in sorted(glob('dictionaries/generic/*.sqlite3')):
+        yield path, os.path.join('generic', os.path.basename(path))
+    for lang in supported_langs:
+        path = 'dictionaries/processed/%s.sqlite3' % lang
+        if os.path.exists(path):
+            yield path, os.path.basename(path)
+
+
+def sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def compress(in_path, out_name, compression):
+    out_name += '.' + compression
+    out_path = os.path.join(out_dir, out_name)
+    if (not os.path.exists(out_path) or
+            os.path.getmtime(out_path) < os.path.getmtime(in_path)):
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        tmp_path = out_path + '.tmp'
+        with open(in_path, 'rb') as in_file, \
+                compressors[compression](tmp_path, 'wb') as out_file:
+            shutil.copyfileobj(in_file, out_file, 1 << 20)
+        os.replace(tmp_path, out_path)
+        print(out_name, flush=True)
+    return out_name, dict(
+        size=os.path.getsize(out_path),
+        uncompressed_size=os.path.getsize(in_path),
+        sha256=sha256(out_path),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--compress', choices=sorted(compressors),
+                        default='gz')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    files = list(release_files())
+    with ProcessPoolExecutor(args.jobs) as pool:
+        manifest = dict(pool.map(
+            compress,
+            [in_path for in_path, _ in files],
+            [out_name for _, out_name in files],
+            [args.compress] * len(files),
+        ))
+
+    with open(os.path.join(out_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    print('{} files, {:.1f} MB compressed, {:.1f} MB uncompressed'.format(
+        len(manifest),
+        sum(m['size'] for m in manifest.values()) / 1e6,
+        sum(m['uncompressed_size'] for m in manifest.values()) / 1e6))
+
+
+if __name__ == '__main__':
+    main()
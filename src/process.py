@@ -1,7 +1,9 @@
 import re
+import sqlite3
 
-from helper import make_targets
+from helper import make_targets, create_function, create_aggregate
 import parse
+from sparql.queries import check_lexentry_ids
 
 sense_num_re = re.compile(r'(\d+)(\w)?')
 
@@ -61,29 +63,34 @@ def parse_sense(sense, lang):
 
 
 def make_entry(conn, lang):
-    conn.create_aggregate("choose_pos", 1, PartOfSpeechChooser)
+    create_aggregate(conn, "choose_pos", 1, PartOfSpeechChooser)
     conn.executescript("""
         DROP TABLE IF EXISTS main.entry;
         CREATE TABLE entry AS
-        SELECT lexentry, vocable, written_rep, part_of_speech, gender,
-            group_concat(pronun, ' | ') AS pronun_list
-        FROM raw.entry
-            LEFT JOIN raw.pos USING (lexentry)
-            LEFT JOIN (
-                SELECT lexentry,
-                    CASE
-                        WHEN min(gender) == max(gender) THEN gender
-                    END AS gender
-                FROM raw.gender
-                GROUP BY lexentry
-            ) USING (lexentry)
-            LEFT JOIN raw.pronun USING (lexentry)
-        -- Actually, I only want to group by lexentry. But by combinding this
-        -- grouping with a unique index, we'll get an error if the result is
-        -- ambiguous.
-        -- TODO: enable this check and resolve the problems
-        --GROUP BY 1, 2, 3,4;
-        GROUP BY lexentry;
+        -- The raw tables use integer ids for the lexentries, only the
+        -- result gets the URIs.
+        SELECT uri AS lexentry, vocable, written_rep, part_of_speech, gender,
+            pronun_list
+        FROM (
+            SELECT lexentry AS id, vocable, written_rep, part_of_speech,
+                (
+                    SELECT CASE
+                            WHEN min(gender) == max(gender) THEN min(gender)
+                        END
+                    FROM raw.gender
+                    WHERE gender.lexentry = entry.lexentry
+                ) AS gender,
+                group_concat(pronun, ' | ') AS pronun_list
+            FROM raw.entry
+                LEFT JOIN raw.pos USING (lexentry)
+                LEFT JOIN raw.pronun USING (lexentry)
+            -- Actually, I only want to group by lexentry. But by combinding
+            -- this grouping with a unique index, we'll get an error if the
+            -- result is ambiguous.
+            -- TODO: enable this check and resolve the problems
+            --GROUP BY 1, 2, 3,4;
+            GROUP BY lexentry
+        ) LEFT JOIN raw.lexentry USING (id);
         CREATE UNIQUE INDEX entry_pkey ON entry(lexentry);
 
 --        SELECT lexentry, written_rep, choose_pos(part_of_speech) AS part_of_speech,
@@ -100,15 +107,17 @@ def make_entry(conn, lang):
 
 
 def make_form(conn, lang):
-    conn.create_function('clean_wiki_syntax', 1, parse.clean_wiki_syntax)
-    conn.create_function('clean_html', 1, parse.html_parser.parse)
+    create_function(conn, 'clean_wiki_syntax', 1, parse.clean_wiki_syntax)
+    create_function(conn, 'clean_html', 1, parse.html_parser.parse)
     conn.executescript("""
         DROP TABLE IF EXISTS main.form;
         CREATE TABLE form AS
-        SELECT lexentry,
+        SELECT uri AS lexentry,
             clean_wiki_syntax(clean_html(other_written)) AS other_written,
             "case", number, inflection, pos
         FROM raw.form
+            LEFT JOIN raw.lexentry ON (id = form.lexentry)
+        ORDER BY form.rowid
     """)
 
 
@@ -127,21 +136,24 @@ def make_importance(conn, lang):
         FROM raw.importance
         GROUP BY vocable;
         CREATE UNIQUE INDEX imp_unique_rep ON importance(written_rep_guess);
+        CREATE UNIQUE INDEX imp_vocable ON importance(vocable);
+        CREATE INDEX imp_score ON importance(score);
 
         -- When searching in two languages, the more popular one will have
         -- the higher importance scores for words. To show at least some
         -- results from the less poplular language, we normalize the scores
         -- for the typeahead and similar features
+        DROP VIEW IF EXISTS importance_high_score;
+        CREATE VIEW importance_high_score AS
+        SELECT avg(score) AS high_score
+        FROM (
+            SELECT * FROM importance
+            ORDER BY score DESC LIMIT 10000
+        );
         DROP VIEW IF EXISTS rel_importance;
         CREATE VIEW rel_importance AS
         SELECT vocable, score, score / high_score AS rel_score, written_rep_guess
-        FROM importance, (
-            SELECT avg(score) AS high_score
-            FROM (
-                SELECT * FROM importance
-                ORDER BY score DESC LIMIT 10000
-            )
-        );
+        FROM importance, importance_high_score;
     """)
 
 
@@ -151,9 +163,9 @@ def make_translation(conn, lang):
     def parse_sense_with_lang(x):
         return parse_sense(x, from_lang)
 
-    conn.create_function('parse_sense_num', 1, parse_sense_num)
-    conn.create_function('parse_sense', 1, parse_sense_with_lang)
-    conn.create_function('clean_wiki_syntax', 1, parse.clean_wiki_syntax)
+    create_function(conn, 'parse_sense_num', 1, parse_sense_num)
+    create_function(conn, 'parse_sense', 1, parse_sense_with_lang)
+    create_function(conn, 'clean_wiki_syntax', 1, parse.clean_wiki_syntax)
     # The outer query removes duplicates in the case of different lexentries
     # with the same translation and sense. E.g. for transitive and intransitive
     # variants of a vocable which both map to the same translation.
@@ -169,13 +181,19 @@ def make_translation(conn, lang):
                 parse_sense(sense) AS sense,
                 written_rep,
                 clean_wiki_syntax(trans) AS trans,
-                from_imp.rel_score AS from_importance,
-                coalesce(to_imp.rel_score, 0.001) AS to_importance
+                -- Same as rel_importance.rel_score. The view can't use
+                -- the importance indexes, since it is a join.
+                from_imp.score / (
+                    SELECT high_score FROM lang.importance_high_score
+                ) AS from_importance,
+                coalesce(to_imp.score / (
+                    SELECT high_score FROM other_lang.importance_high_score
+                ), 0.001) AS to_importance
             FROM raw.translation
                 JOIN lang.entry USING (lexentry)
-                JOIN lang.rel_importance from_imp USING (vocable)
-                -- TODO: the join condition is an ugly hack, and slow!
-                LEFT JOIN other_lang.rel_importance to_imp ON (trans = to_imp.written_rep_guess)
+                JOIN lang.importance from_imp USING (vocable)
+                -- TODO: the join condition is an ugly hack
+                LEFT JOIN other_lang.importance to_imp ON (trans = to_imp.written_rep_guess)
         )
         WHERE trans != ''
         GROUP BY sense_num, sense, written_rep, trans;
@@ -184,6 +202,13 @@ def make_translation(conn, lang):
 
 def do(lang, only, sql, **kwargs):
     if '-' not in lang:
+        # The ids are added by `run.py raw` once all tables are fetched
+        raw_path = 'dictionaries/raw/%s.sqlite3' % lang
+        raw_conn = sqlite3.connect(raw_path)
+        try:
+            check_lexentry_ids(raw_conn, raw_path)
+        finally:
+            raw_conn.close()
         targets = [
             ('entry', make_entry),
             ('form', make_form),
@@ -214,7 +239,7 @@ def do(lang, only, sql, **kwargs):
 def add_subparsers(subparsers):
     process = subparsers.add_parser(
         'process', help='process raw db into a new processed db')
-    process.add_argument('lang')
+    process.add_argument('lang', nargs='+')
     process.set_defaults(func=do)
     process.add_argument('--only')
     process.add_argument('--sql')
@@ -0,0 +1,121 @@
+""" Progress reports for long running SQL statements and SPARQL fetches
+
+Reports are written to stderr, at most once per `INTERVAL` seconds, either
+as a single status line which is overwritten (`mode = 'line'`) or as one
+JSON object per line (`mode = 'json'`). With `mode = None` nothing is
+reported. run.py sets the mode with `--progress`.
+"""
+import sys
+import json
+import time
+
+mode = None
+INTERVAL = 1.0
+# SQLite calls the progress handler after this many VM instructions
+VM_STEPS = 100000
+
+
+def format_seconds(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '{}:{:02}:{:02}'.format(hours, minutes, seconds)
+
+
+class Reporter:
+    """ Throttled progress output for a single task
+
+    `expected` is the previous run's final value of `field`, or its duration
+    in seconds if no `field` is given. It is used to estimate the remaining
+    time.
+    """
+
+    def __init__(self, task, expected=None, field=None, out=sys.stderr):
+        self.task = task
+        self.field = field
+        self.expected = expected
+        self.out = out
+        self.start = time.perf_counter()
+        self.last_report = self.start
+        self.width = 0
+
+    def eta(self, elapsed, fields):
+        if not self.expected:
+            return None
+        if not self.field:
+            return max(self.expected - elapsed, 0)
+        done = fields.get(self.field)
+        if not done:
+            return None
+        return max(elapsed * (self.expected - done) / done, 0)
+
+    def update(self, force=False, **fields):
+        now = time.perf_counter()
+        if not mode or (not force and now - self.last_report < INTERVAL):
+            return
+        self.last_report = now
+        elapsed = now - self.start
+        eta = self.eta(elapsed, fields)
+        if mode == 'json':
+            event = dict(task=self.task, elapsed=round(elapsed, 3), **fields)
+            if eta is not None:
+                event['eta'] = round(eta, 3)
+            print(json.dumps(event), file=self.out, flush=True)
+        else:
+            line = '{} {}  {}'.format(
+                self.task, format_seconds(elapsed),
+                '  '.join('{} {}'.format(k, v) for k, v in fields.items()))
+            if eta is not None:
+                line += '  eta ' + format_seconds(eta)
+            line = line[:120]
+            print('\r' + line.ljust(self.width), end='', file=self.out,
+                  flush=True)
+            self.width = len(line)
+
+    def finish(self, **fields):
+        self.update(force=True, done=True, **fields)
+        if mode == 'line':
+            print(file=self.out, flush=True)
+
+
+class StatementProgress:
+    """ Report VM steps and elapsed time of the running SQL statement
+
+    Use the instance as trace callback (see `helper.trace`), so that it
+    knows when a new statement starts.
+    """
+
+    def __init__(self, conn, task, expected_seconds=None):
+        self.conn = conn
+        self.reporter = Reporter(task, expected_seconds)
+        self.statements = 0
+        self.statement = ''
+        self.steps = 0
+        self.statement_start = time.perf_counter()
+        conn.set_progress_handler(self.handler, VM_STEPS)
+
+    def __call__(self, statement):
+        self.statements += 1
+        self.statement = ' '.join(statement.split())
+        self.steps = 0
+        self.statement_start = time.perf_counter()
+
+    def handler(self):
+        self.steps += VM_STEPS
+        now = time.perf_counter()
+        self.reporter.update(
+            statement=self.statements,
+            steps=self.steps,
+            statement_seconds=round(now - self.statement_start, 1),
+            sql=self.statement[:60],
+        )
+        return 0  # continue
+
+    def finish(self):
+        self.conn.set_progress_handler(None, 0)
+        self.reporter.finish(statements=self.statements)
+
+
+def watch(conn, task, expected_seconds=None):
+    """ Start reporting the progress of `conn`'s statements if enabled """
+    if mode:
+        return StatementProgress(conn, task, expected_seconds)
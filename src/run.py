@@ -1,32 +1,74 @@
 #!venv/bin/python
 import os
+import sys
 import argparse
+import importlib
 import subprocess
-from pysqlite3 import dbapi2 as sqlite3
+
+import helper
+import progress
+import manifest
 
 BASE_PATH = os.path.dirname(os.path.realpath(__file__))
 
+# Modules providing the subcommands, only the used one is imported
+command_modules = {
+    'raw': 'sparql.run',
+    'process': 'process',
+    'wdweb': 'wdweb',
+    'wdweb-bench': 'wdweb',
+    'infer-collect': 'infer',
+    'infer': 'infer',
+    'generic': 'generic',
+}
+
 
 def search_query(from_lang, to_lang, search_term, **kwargs):
+    from pysqlite3 import dbapi2 as sqlite3
+    import wdweb
     conn = sqlite3.connect(
         'dictionaries/wdweb/%s-%s.sqlite3'
         % (from_lang, to_lang))
-    for r in conn.execute("""
-                SELECT lexentry, written_rep, sense_list, trans_list
-                FROM (
-                        SELECT DISTINCT written_rep
-                        FROM search_trans
-                        WHERE form MATCH :term
-                    )
-                    JOIN translation USING (written_rep)
-                ORDER BY
-                    lower(written_rep) LIKE '%'|| lower(:term) ||'%' DESC, length(written_rep),
-                    lexentry, coalesce(min_sense_num, '99'), importance * translation_score DESC
-                LIMIT 100
-            """, dict(term=search_term)):
+    conn.execute("ATTACH DATABASE 'dictionaries/wdweb/%s.sqlite3' AS lang"
+                 % from_lang)
+    for r in wdweb.search(conn, search_term):
         print('%-40s %-20s %-80s %s' % r)
 
 
+def add_global_options(parser):
+    parser.add_argument(
+        '--explain', action='store_true',
+        help='add query plans of all statements to the build log')
+    parser.add_argument(
+        '--profile', action='store_true',
+        help='run the command under cProfile and print the slowest calls')
+    parser.add_argument(
+        '--trace-sql', action='store_true',
+        help='print every SQL statement with its duration to stderr')
+    parser.add_argument(
+        '--progress', choices=['line', 'json'],
+        help='report progress of SQL statements and SPARQL fetches to stderr')
+    parser.add_argument(
+        '--force', action='store_true',
+        help='rebuild even if the build manifest says nothing changed')
+    parser.add_argument(
+        '--build-profile', choices=sorted(helper.build_profiles),
+        default='default', help='SQLite pragmas used for all dbs')
+    parser.add_argument(
+        '--stage-in-memory', type=int, default=0, metavar='MB',
+        help='copy input dbs shared by several targets up to this size '
+             'into memory')
+
+
+def run_command(func, lang=None, **kwargs):
+    """ Run `func` once for each of the given languages and pairs """
+    if lang is None:
+        return func(func=func, **kwargs)
+    # Pairs depend on their single languages, so do those first
+    for single_lang in sorted(lang, key=lambda l: '-' in l):
+        func(func=func, lang=single_lang, **kwargs)
+
+
 def interactive(from_lang, to_lang, **kwargs):
     with open('/tmp/attach_dbs.sql', 'w') as f:
         f.write(attach_dbs(from_lang, to_lang))
@@ -42,6 +84,7 @@ def interactive(from_lang, to_lang, **kwargs):
 
 
 def attach_dbs(from_lang, to_lang):
+    from pysqlite3 import dbapi2 as sqlite3
     main_db_filename = 'dictionaries/sqlite/prod/wikdict.sqlite3'
     if not os.path.isfile(main_db_filename):
         conn = sqlite3.connect(main_db_filename)
@@ -59,20 +102,19 @@ def attach_dbs(from_lang, to_lang):
 
 
 if __name__ == '__main__':
+    # Find the command first, so that only its module has to be imported
+    pre_parser = argparse.ArgumentParser(add_help=False)
+    add_global_options(pre_parser)
+    pre_parser.add_argument('cmd', nargs='?')
+    cmd = pre_parser.parse_known_args()[0].cmd
+
     parser = argparse.ArgumentParser()
+    add_global_options(parser)
     subparsers = parser.add_subparsers(dest='cmd')
     subparsers.required = True
-
-    import sparql.run as sparql_run
-    sparql_run.add_subparsers(subparsers)
-    import process
-    process.add_subparsers(subparsers)
-    import wdweb
-    wdweb.add_subparsers(subparsers)
-    import infer
-    infer.add_subparsers(subparsers)
-    import generic
-    generic.add_subparsers(subparsers)
+    for module_name in sorted(set(command_modules.values())):
+        if cmd not in command_modules or command_modules[cmd] == module_name:
+            importlib.import_module(module_name).add_subparsers(subparsers)
 
     search = subparsers.add_parser('search')
     search.add_argument('from_lang')
@@ -86,4 +128,26 @@ if __name__ == '__main__':
     inter.set_defaults(func=interactive)
 
     args = parser.parse_args()
-    args.func(**vars(args))
+    helper.explain_query_plans = args.explain
+    progress.mode = args.progress
+    manifest.force = args.force
+    helper.build_profile = args.build_profile
+    helper.memory_staging_limit = args.stage_in_memory
+    helper.count_udf_calls = args.profile or args.trace_sql
+    if args.trace_sql:
+        helper.sql_tracer = helper.SQLTracer()
+    if args.profile:
+        import cProfile
+        import pstats
+        profiler = cProfile.Profile()
+        profiler.runcall(run_command, **vars(args))
+    else:
+        run_command(**vars(args))
+    if helper.sql_tracer:
+        helper.sql_tracer.flush()
+    if args.profile:
+        pstats.Stats(profiler, stream=sys.stderr) \
+            .sort_stats('cumulative').print_stats(40)
+    if helper.count_udf_calls:
+        print('Python function calls from SQL:', file=sys.stderr)
+        helper.print_udf_calls()
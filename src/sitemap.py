@@ -2,16 +2,25 @@
 
 import os
 import sqlite3
+import argparse
 from datetime import date
+from functools import lru_cache
 
-main_db = sqlite3.connect('dictionaries/wdweb/wikdict.sqlite3')
-main_db.row_factory = sqlite3.Row
-sitemap_tmpl = """
+# Limits from the sitemap protocol
+MAX_URLS = 50000
+MAX_BYTES = 50 * 1024 * 1024
+
+sitemap_header = """
 <?xml version="1.0" encoding="UTF-8"?>
 <urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
-{}
-</urlset>
-""".strip()
+""".lstrip()
+sitemap_footer = "\n</urlset>"
+url_tmpl = '''
+        <url>
+            <loc>https://www.wikdict.com/{}/{}</loc>
+            <changefreq>monthly</changefreq>
+        </url>
+        '''
 sitemap_index_tmpl = """
 <?xml version="1.0" encoding="UTF-8"?>
 <sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
@@ -20,22 +29,69 @@ sitemap_index_tmpl = """
 """.strip()
 
 
-def make_sitemap(pair, lang):
-    cur = sqlite3.connect('dictionaries/processed/%s.sqlite3' % lang).cursor()
-    cur.execute('SELECT vocable FROM importance ORDER BY score DESC LIMIT 1000')
-    urls = ''.join(
-        '''
-        <url>
-            <loc>https://www.wikdict.com/{}/{}</loc>
-            <changefreq>monthly</changefreq>
-        </url>
-        '''.format(pair, vocable)
-        for (vocable,) in cur
-    )
-    filename = 'sitemap/{}-{}.xml'.format(pair, lang)
-    with open(filename, 'w') as f:
-        f.write(sitemap_tmpl.format(urls))
-    return filename
+@lru_cache(maxsize=None)
+def top_vocables(lang, limit):
+    """ The most important vocables of a language, fetched once per run """
+    conn = sqlite3.connect('dictionaries/processed/%s.sqlite3' % lang)
+    vocables = [vocable for (vocable,) in conn.execute(
+        'SELECT vocable FROM importance ORDER BY score DESC LIMIT ?',
+        [limit])]
+    conn.close()
+    return vocables
+
+
+class SitemapWriter:
+    """ Write URLs to sitemap files, starting a new file at the size limits
+
+    The first file is called `<name>.xml`, the following ones `<name>-2.xml`
+    and so on.
+    """
+
+    def __init__(self, name, max_urls=MAX_URLS, max_bytes=MAX_BYTES):
+        self.name = name
+        self.max_urls = max_urls
+        self.max_bytes = max_bytes
+        self.filenames = []
+        self.file = None
+
+    def _open(self):
+        number = len(self.filenames) + 1
+        filename = 'sitemap/{}{}.xml'.format(
+            self.name, '' if number == 1 else '-%d' % number)
+        self.filenames.append(filename)
+        self.file = open(filename, 'w', encoding='utf-8')
+        self.file.write(sitemap_header)
+        self.urls = 0
+        self.bytes = len(sitemap_header.encode()) + len(sitemap_footer)
+
+    def _close(self):
+        if self.file:
+            self.file.write(sitemap_footer)
+            self.file.close()
+            self.file = None
+
+    def write(self, url_xml):
+        size = len(url_xml.encode())
+        if (not self.file or self.urls >= self.max_urls
+                or self.bytes + size > self.max_bytes):
+            self._close()
+            self._open()
+        self.file.write(url_xml)
+        self.urls += 1
+        self.bytes += size
+
+    def close(self):
+        if not self.filenames:
+            self._open()  # write an empty sitemap
+        self._close()
+        return self.filenames
+
+
+def make_sitemap(pair, lang, limit):
+    writer = SitemapWriter('{}-{}'.format(pair, lang))
+    for vocable in top_vocables(lang, limit):
+        writer.write(url_tmpl.format(pair, vocable))
+    return writer.close()
 
 
 def make_sitemap_index(sitemaps):
@@ -53,17 +109,25 @@ def make_sitemap_index(sitemaps):
 
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--limit', type=int, default=1000,
+        help='number of vocables per language and pair')
+    args = parser.parse_args()
+
     os.makedirs('sitemap', exist_ok=True)
+    main_db = sqlite3.connect('dictionaries/wdweb/wikdict.sqlite3')
+    main_db.row_factory = sqlite3.Row
     cur = main_db.cursor()
     cur.execute("SELECT * FROM lang_pair")
     sitemaps = []
     for row in cur:
         pair = row['from_lang'] + '-' + row['to_lang']
         print(pair)
-        sitemaps.extend([
-            make_sitemap(pair, row['from_lang']),
-            make_sitemap(pair, row['to_lang'])
-        ])
+        sitemaps.extend(make_sitemap(pair, row['from_lang'], args.limit))
+        sitemaps.extend(make_sitemap(pair, row['to_lang'], args.limit))
     make_sitemap_index(sitemaps)
 
-main()
+
+if __name__ == '__main__':
+    main()
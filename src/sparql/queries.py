@@ -1,12 +1,20 @@
-import urllib.request, urllib.error, urllib.parse
 from urllib.parse import urlencode
 import sqlite3
 import re
 import os
 import json
-from itertools import chain
+import hashlib
 
 from languages import language_codes3
+import progress
+from .transport import Transport, HTTPError
+
+# Replaced by `run.py raw` to apply the timeout and retry options
+transport = Transport()
+# Rows per request, checkpoints are written after each page
+PAGE_SIZE = int(5e5)
+#SERVER = 'http://kaiko.getalp.org'
+SERVER = 'http://localhost:8890'
 
 namespace_re = re.compile(r'^(?:http://kaiko.getalp.org/dbnary/|http://.*#)')
 fr_sense_re = re.compile(r'^(.*?)[.]?\s*(?:\(\d+\)|\|\d+)?:?$')
@@ -168,6 +176,32 @@ translation_query = {
 }
 
 
+def all_targets_translation_query(query_type, to_langs):
+    """ Translation query fetching all `to_langs` at once
+
+    Each of the per pair queries walks all lexentries of the source language
+    again, so fetching the translations for all targets in one query saves
+    most of Virtuoso's work. The target language's lexvo URI is returned as
+    additional last column `target_language`.
+
+    Each lexentry has rows for several targets, which a page boundary can
+    split. So instead of `make_url`'s `ORDER BY 1`, the rows are ordered
+    by all columns, to get the same pages for each OFFSET. The columns
+    are given by position, since ?trans is both a variable and an alias.
+    """
+    query = translation_query[query_type].replace(
+        'dbnary:targetLanguage lexvo:%(to_lang3)s',
+        'dbnary:targetLanguage ?target_language')
+    query = re.sub(r'\n(\s*)WHERE', r'\n\1    ?target_language\n\1WHERE',
+                   query, count=1)
+    end = query.rindex('}')
+    query = query[:end] + '    FILTER (?target_language IN (%s))\n        ' % (
+        ', '.join('lexvo:' + language_codes3[lang] for lang in to_langs)
+    ) + query[end:]
+    # lexentry, target_language, trans_entity, sense_num, sense, trans
+    return query + 'ORDER BY 1 6 4 2 3 5\n'
+
+
 importance_query = """
     SELECT ?vocable
         bif:sqrt(?translation_count) + bif:sqrt(?synonym_count) AS ?score
@@ -202,8 +236,6 @@ importance_query = """
 
 def make_url(query, **fmt_args):
     assert fmt_args['limit'] <= 1048576, 'Virtuoso does not support more than 1048576 results'
-    #server = 'http://kaiko.getalp.org'
-    server = 'http://localhost:8890'
     if 'ORDER BY' not in query:
         query += '\nORDER BY 1'
     query = """
@@ -217,7 +249,7 @@ def make_url(query, **fmt_args):
     for key, val in list(fmt_args.items()):
         if key.endswith('lang'):
             fmt_args[key + '3'] = language_codes3[val]
-    url = server + '/sparql?' + urlencode({
+    url = SERVER + '/sparql?' + urlencode({
         'default-graph-uri': '',
         'query': query % fmt_args,
         'format': 'application/json',
@@ -227,39 +259,100 @@ def make_url(query, **fmt_args):
     return url
 
 
-def page_through_results(query, limit, **kwargs):
-    offset = 0
+def read_response(response, reporter, **fields):
+    """ Read the whole response, reporting the number of bytes received """
+    chunks = []
+    received = 0
+    for chunk in iter(lambda: response.read(1 << 20), b''):
+        chunks.append(chunk)
+        received += len(chunk)
+        reporter.update(bytes=fields['bytes'] + received,
+                        rows=fields['rows'], page=fields['page'])
+    return b''.join(chunks)
+
+
+def page_through_results(query, limit, reporter=None, offset=0, **kwargs):
+    received = 0
+    reporter = reporter or progress.Reporter('fetch')
     while True:
         url = make_url(query, limit=limit, offset=offset, **kwargs)
-        try:
-            response = urllib.request.urlopen(url)
-        except urllib.error.HTTPError as e:
-            print(e.read())
-            raise
-        #raw_json = response.read()
-        #with open('debug.json', 'w') as f:
-        #    f.write(raw_json)
-        #raw_json = raw_json.decode("unicode_escape")
-        #raw_json = open('debug.json').read()
-        #data = json.loads(raw_json)
-
         # This should be
         #    data = json.load(response)
         # but virtuoso generates invalid json, so we have to work around it.
         # See https://github.com/dbpedia/extraction-framework/issues/318
         from codecs import raw_unicode_escape_decode
-        json_data = raw_unicode_escape_decode(response.read())[0]
+        try:
+            raw_json = transport.fetch(url, lambda response: read_response(
+                response, reporter, bytes=received, rows=offset,
+                page=offset // limit + 1))
+        except HTTPError as e:
+            print(e.body)
+            raise
+        received += len(raw_json)
+        json_data = raw_unicode_escape_decode(raw_json)[0]
         data = json.loads(json_data)
 
         global cols
         cols = data['head']['vars']
         result = data['results']['bindings']
+        reporter.update(force=True, bytes=received, rows=offset + len(result),
+                        page=offset // limit + 1)
         yield result
         if len(result) < limit:
             break
         else:
             offset += limit
-            print('.')
+            if not progress.mode:
+                print('.')
+
+
+def previous_row_count(conn, table_name):
+    """ Number of rows fetched by the last run, if it is still there """
+    try:
+        return conn.execute(
+            'SELECT count(*) FROM "%s"' % table_name).fetchone()[0]
+    except sqlite3.OperationalError:
+        return None
+
+
+def query_hash(query, limit, **kwargs):
+    """ Identifies the pages fetched for `query` """
+    return hashlib.sha256(
+        make_url(query, limit=limit, offset=0, **kwargs).encode()
+    ).hexdigest()
+
+
+def read_checkpoint(conn, table_name, key):
+    """ (next offset, rows, complete) of a previous fetch of the same query
+
+    Only returned if the table still contains the rows of the checkpoint.
+    """
+    try:
+        checkpoint = conn.execute("""
+            SELECT next_offset, rows, complete FROM fetch_checkpoint
+            WHERE table_name = ? AND query_hash = ?
+        """, [table_name, key]).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    if checkpoint and previous_row_count(conn, table_name) == checkpoint[1]:
+        return checkpoint
+
+
+def write_checkpoint(conn, table_name, key, next_offset, rows, complete):
+    """ Record the fetched pages, committed together with their rows """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS fetch_checkpoint (
+            table_name text PRIMARY KEY,
+            query_hash text NOT NULL,
+            next_offset int NOT NULL,
+            rows int NOT NULL,
+            complete int NOT NULL
+        )
+    """)
+    conn.execute("""
+        INSERT OR REPLACE INTO fetch_checkpoint VALUES (?, ?, ?, ?, ?)
+    """, [table_name, key, next_offset, rows, complete])
+    conn.commit()
 
 
 def create_table(conn, table_name, first_result=None):
@@ -297,42 +390,194 @@ def create_table(conn, table_name, first_result=None):
     conn.executescript(sql)
 
 
-def get_query(table_name, query, **kwargs):
-    if 'lang' in kwargs:
-        lang = kwargs['lang']
-        db_name = lang
-    else:
-        lang = kwargs['from_lang']
-        kwargs['lang'] = lang
-        db_name = '{}-{}'.format(kwargs['from_lang'], kwargs['to_lang'])
+def get_split_query(table_name, query, from_lang, to_langs, resume=False):
+    """ Fetch `query` once and split its rows into the per pair raw dbs
 
-    print('Fetch {} (SPARQL)'.format(table_name))
-    limit = int(5e5)
-    batches = page_through_results(query, limit=limit, **kwargs)
-    results = chain.from_iterable(batches)
+    The `target_language` column of `query` must contain the lexvo URI of
+    the target language (see `all_targets_translation_query`). It is not stored, so
+    the tables are created from their saved definition in src/sql/sparql.
+    Each pair db gets a checkpoint after every page. Resuming is possible
+    if all of them agree.
+    """
+    print('Fetch {} for {} target languages (SPARQL)'.format(
+        table_name, len(to_langs)))
     path = 'dictionaries/raw'
     os.makedirs(path, exist_ok=True)
-    conn = sqlite3.connect('%s/%s.sqlite3' % (path, db_name))
+    to_lang_by_code3 = {language_codes3[lang]: lang for lang in to_langs}
+    conns = {
+        lang: sqlite3.connect('%s/%s-%s.sqlite3' % (path, from_lang, lang))
+        for lang in to_langs
+    }
+    limit = PAGE_SIZE
+    key = query_hash(query, limit, from_lang=from_lang, lang=from_lang)
+    checkpoints = {lang: read_checkpoint(conn, table_name, key)
+                   for lang, conn in conns.items()}
+    if resume and all(checkpoints.values()) and len(
+            {(c[0], c[2]) for c in checkpoints.values()}) == 1:
+        offset, _, complete = checkpoints[to_langs[0]]
+        inserted = {lang: c[1] for lang, c in checkpoints.items()}
+    else:
+        offset, complete = 0, False
+        inserted = dict.fromkeys(to_langs, 0)
+    if complete:
+        print('Already fetched')
+    elif offset:
+        print('Resuming at row', offset)
+
+    previous_counts = [previous_row_count(conn, table_name)
+                       for conn in conns.values()]
+    reporter = progress.Reporter(
+        '{}-* {}'.format(from_lang, table_name),
+        expected=sum(c or 0 for c in previous_counts) or None, field='rows')
+    if not offset:
+        for conn in conns.values():
+            create_table(conn, table_name)
+
+    postprocess_row = row_postprocessor(from_lang)
+    batches = [] if complete else page_through_results(
+        query, limit=limit, offset=offset, reporter=reporter,
+        from_lang=from_lang, lang=from_lang)
+    for batch in batches:
+        target_col = cols.index('target_language')
+        rows_by_lang = {}
+        for r in batch:
+            row = postprocess_row(r)
+            target_language = row.pop(target_col)
+            to_lang = to_lang_by_code3[target_language.rsplit('/', 1)[-1]]
+            rows_by_lang.setdefault(to_lang, []).append(row)
+        for to_lang, rows in rows_by_lang.items():
+            conns[to_lang].executemany(
+                "INSERT INTO %s VALUES (%s)" % (
+                    table_name, ', '.join(['?'] * len(rows[0]))),
+                rows)
+            inserted[to_lang] += len(rows)
+        offset += limit
+        for to_lang, conn in conns.items():
+            write_checkpoint(conn, table_name, key, offset, inserted[to_lang],
+                             len(batch) < limit)
+
+    reporter.finish(rows=sum(inserted.values()))
+    for to_lang, conn in conns.items():
+        print('Inserted', inserted[to_lang], 'rows into',
+              '{}-{}'.format(from_lang, to_lang))
+        conn.close()
+
+# Raw tables of a single language which reference lexentries
+LEXENTRY_TABLES = ['entry', 'pos', 'gender', 'pronun', 'form']
+
+
+def add_lexentry_ids(conn):
+    """ Replace the lexentry URIs in the raw tables with integer ids
+
+    The URIs are stored once in `lexentry(id, uri)`. New URIs are appended,
+    so that the ids in tables converted earlier stay valid when a single
+    table is fetched again. Tables which already use ids are skipped, as
+    are tables with an incomplete fetch, since resuming it appends URIs.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS lexentry (
+            id INTEGER PRIMARY KEY,
+            uri text NOT NULL UNIQUE
+        )
+    """)
+    for table in LEXENTRY_TABLES:
+        cols = [(name, col_type) for _, name, col_type, *_
+                in conn.execute('PRAGMA table_info("%s")' % table)]
+        if dict(cols).get('lexentry', '').lower() != 'text':
+            continue
+        if not fetch_complete(conn, table):
+            print('Not converting incomplete table', table)
+            continue
+        conn.execute("""
+            INSERT OR IGNORE INTO lexentry(uri)
+            SELECT DISTINCT lexentry FROM {table}
+            WHERE lexentry IS NOT NULL
+            ORDER BY lexentry
+        """.format(table=table))
+        conn.executescript("""
+            CREATE TABLE new_{table} ({col_def});
+            INSERT INTO new_{table}
+            SELECT {select}
+            FROM {table} t LEFT JOIN lexentry ON (uri = t.lexentry)
+            ORDER BY t.rowid;
+            DROP TABLE {table};
+            ALTER TABLE new_{table} RENAME TO {table};
+        """.format(
+            table=table,
+            col_def=', '.join(
+                '"lexentry" int' if name == 'lexentry'
+                else '"%s" %s' % (name, col_type)
+                for name, col_type in cols),
+            select=', '.join(
+                'lexentry.id' if name == 'lexentry' else 't."%s"' % name
+                for name, _ in cols),
+        ))
+    conn.commit()
 
-    try:
-        first_result = next(results)
-    except StopIteration:
-        print('No results!')
-        create_table(conn, table_name)  # create empty table
-        return
 
-    # put first result back into iterable
-    results = chain([first_result], results)
+def fetch_complete(conn, table_name):
+    """ False if the last fetch of `table_name` did not finish
 
-    create_table(conn, table_name, first_result)
+    Tables without a checkpoint, like synthetic ones, count as complete.
+    """
+    try:
+        checkpoint = conn.execute("""
+            SELECT complete FROM fetch_checkpoint WHERE table_name = ?
+        """, [table_name]).fetchone()
+    except sqlite3.OperationalError:
+        return True
+    return not checkpoint or bool(checkpoint[0])
+
+
+def check_lexentry_ids(conn, path):
+    """ Fail unless all raw tables of a language use lexentry ids """
+    has_lexentry = conn.execute("""
+        SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'lexentry'
+    """).fetchone()
+    unconverted = [
+        table for table in LEXENTRY_TABLES
+        if any(name == 'lexentry' and col_type.lower() == 'text'
+               for _, name, col_type, *_
+               in conn.execute('PRAGMA table_info("%s")' % table))
+    ]
+    if not has_lexentry or unconverted:
+        raise Exception(
+            '{} has no lexentry ids{}. Convert it with `src/run.py raw <lang> '
+            '--convert-ids`, or finish an interrupted fetch with '
+            '`src/run.py raw <lang> --resume`.'.format(
+                path, unconverted and ' in ' + ', '.join(unconverted) or ''))
+
+
+def create_raw_indexes(conn):
+    """ Index the raw tables of a language for the process stage
+
+    This is done after the bulk load, which is faster than updating the
+    indexes while inserting.
+    """
+    conn.executescript("""
+        CREATE INDEX IF NOT EXISTS entry_lexentry_idx ON entry(lexentry);
+        CREATE INDEX IF NOT EXISTS pos_lexentry_idx ON pos(lexentry);
+        CREATE INDEX IF NOT EXISTS gender_lexentry_idx
+            ON gender(lexentry, gender);
+        CREATE INDEX IF NOT EXISTS pronun_lexentry_idx ON pronun(lexentry);
+        CREATE INDEX IF NOT EXISTS importance_vocable_idx
+            ON importance(vocable, score);
+    """)
+
+
+py_types = {
+    'http://www.w3.org/2001/XMLSchema#integer': int,
+    'http://www.w3.org/2001/XMLSchema#decimal': float,
+    'http://www.w3.org/2001/XMLSchema#double': float,
+    'http://www.w3.org/2001/XMLSchema#string': str,
+}
 
-    py_types = {
-        'http://www.w3.org/2001/XMLSchema#integer': int,
-        'http://www.w3.org/2001/XMLSchema#decimal': float,
-        'http://www.w3.org/2001/XMLSchema#double': float,
-        'http://www.w3.org/2001/XMLSchema#string': str,
-    }
 
+def row_postprocessor(lang):
+    """ Returns a function converting a result row into a list of values
+
+    The values are in the order of the global `cols`.
+    """
     def postprocess_literal(col_name, value, **kwargs):
         if lang == 'fr' and col_name == 'sense':
             # remove sense number references from the end of the gloss
@@ -348,7 +593,7 @@ def get_query(table_name, query, **kwargs):
             lambda col_name, value, datatype, **kwargs: py_types[datatype](value)
     }
 
-    def postprocess_row(row):
+    def postprocess_cells(row):
         for col_name in cols:
             if col_name not in row:
                 yield None
@@ -361,13 +606,63 @@ def get_query(table_name, query, **kwargs):
                 processed = processed.encode('utf-8', 'replace').decode()
             yield processed
 
-    print('Inserting into db')
-    cur = conn.cursor()
-    cur.executemany("INSERT INTO %s VALUES (%s)" % (
-                        table_name, ', '.join(['?'] * len(cols))
-                     ),
-                     (list(postprocess_row(r)) for r in results))
-    print('Inserted', cur.rowcount, 'rows')
+    def postprocess_row(row):
+        return list(postprocess_cells(row))
+
+    return postprocess_row
 
-    conn.commit()
+
+def get_query(table_name, query, resume=False, **kwargs):
+    """ Fetch `query` into `table_name` of the raw db
+
+    A checkpoint is committed together with the rows of each page. With
+    `resume`, a fetch of the same query continues after the last page in
+    the checkpoint, or is skipped if it was complete.
+    """
+    if 'lang' in kwargs:
+        lang = kwargs['lang']
+        db_name = lang
+    else:
+        lang = kwargs['from_lang']
+        kwargs['lang'] = lang
+        db_name = '{}-{}'.format(kwargs['from_lang'], kwargs['to_lang'])
+
+    print('Fetch {} (SPARQL)'.format(table_name))
+    path = 'dictionaries/raw'
+    os.makedirs(path, exist_ok=True)
+    conn = sqlite3.connect('%s/%s.sqlite3' % (path, db_name))
+    limit = PAGE_SIZE
+    key = query_hash(query, limit, **kwargs)
+    checkpoint = resume and read_checkpoint(conn, table_name, key)
+    offset, rows, complete = checkpoint or (0, 0, False)
+    if complete:
+        print('Already fetched')
+        conn.close()
+        return
+    if offset:
+        print('Resuming at row', offset)
+
+    reporter = progress.Reporter(
+        '{} {}'.format(db_name, table_name),
+        expected=previous_row_count(conn, table_name), field='rows')
+    batches = page_through_results(query, limit=limit, offset=offset,
+                                   reporter=reporter, **kwargs)
+    postprocess_row = row_postprocessor(lang)
+    for batch in batches:
+        if not offset:
+            if not batch:
+                print('No results!')
+            # without results, the table is created from the saved sql
+            create_table(conn, table_name, batch[0] if batch else None)
+        conn.executemany("INSERT INTO %s VALUES (%s)" % (
+                            table_name, ', '.join(['?'] * len(cols))
+                         ),
+                         (postprocess_row(r) for r in batch))
+        rows += len(batch)
+        offset += limit
+        write_checkpoint(conn, table_name, key, offset, rows,
+                         len(batch) < limit)
+
+    reporter.finish(rows=rows)
+    print('Inserted', rows, 'rows')
     conn.close()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+""" Local stand-in for Virtuoso's /sparql endpoint
+
+Usage: python3 -m sparql.replay_server [--rows N | --replay FILE] [--port P]
+                                       [--latency S] [--bandwidth MB/S]
+
+Answers every query with pages of a single result set, selected by the
+query's trailing `OFFSET x LIMIT y` (see `queries.make_url`). The result
+set is either synthetic, shaped like the translation query, or replayed
+from a response recorded from Virtuoso.
+
+Pages are written in Virtuoso's JSON dialect, which escapes non-ASCII
+characters as \\uXXXX and characters outside the BMP as \\UXXXXXXXX. The
+latter is not valid JSON, which is why `page_through_results` has to
+decode the escapes itself. Latency and bandwidth can be limited to mimic
+a remote server.
+"""
+import re
+import json
+import time
+import gzip
+import random
+import argparse
+from codecs import raw_unicode_escape_decode
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+page_re = re.compile(r'OFFSET\s+(\d+)\s+LIMIT\s+(\d+)\s*$')
+CHUNK_SIZE = 1 << 16
+escaped_re = re.compile('["\\\\\x00-\x1f\x7f-\U0010ffff]')
+short_escapes = {'"': '\\"', '\\': '\\\\', '\n': '\\n', '\t': '\\t'}
+
+
+def escape_char(match):
+    c = match.group()
+    if c in short_escapes:
+        return short_escapes[c]
+    if ord(c) < 0x10000:
+        return '\\u%04x' % ord(c)
+    return '\\U%08x' % ord(c)
+
+
+def escape(value):
+    """ JSON string body the way Virtuoso writes it """
+    return escaped_re.sub(escape_char, value)
+
+
+def encode_binding(binding):
+    cells = []
+    for name, cell in binding.items():
+        fields = ['"type": "%s"' % cell['type']]
+        if 'xml:lang' in cell:
+            fields.append('"xml:lang": "%s"' % cell['xml:lang'])
+        if 'datatype' in cell:
+            fields.append('"datatype": "%s"' % cell['datatype'])
+        fields.append('"value": "%s"' % escape(cell['value']))
+        cells.append('"%s": { %s }' % (name, ', '.join(fields)))
+    return ('{ ' + '\t, '.join(cells) + ' }').encode('ascii')
+
+
+class ResultSet:
+    """ Bindings of a query, pre-encoded to serve pages quickly """
+
+    def __init__(self, variables, bindings):
+        self.variables = variables
+        self.rows = [encode_binding(b) for b in bindings]
+
+    @classmethod
+    def from_response(cls, raw_json):
+        """ Read a response recorded from Virtuoso """
+        data = json.loads(raw_unicode_escape_decode(raw_json)[0])
+        return cls(data['head']['vars'], data['results']['bindings'])
+
+    def page(self, offset, limit):
+        head = '{ "head": { "link": [], "vars": [%s] },\n' % ', '.join(
+            '"%s"' % v for v in self.variables)
+        return (
+            head.encode() +
+            b'  "results": { "distinct": false, "ordered": true, '
+            b'"bindings": [\n    ' +
+            b',\n    '.join(self.rows[offset:offset + limit]) +
+            b' ] } }'
+        )
+
+
+def synthetic_results(rows, seed=0):
+    """ Translation query results, including characters Virtuoso escapes """
+    rand = random.Random(seed)
+    letters = 'abcdefghijklmnopqrstuvwxyz' + 'äöüßéçñ' + 'ɪʃ' + '日本'
+    words = [''.join(rand.choice(letters) for _ in range(rand.randint(3, 10)))
+             for _ in range(1000)]
+    words += ['say "hi"', 'back\\slash', 'emoji \U0001F600', 'tab\tbed']
+
+    def literal(value, lang):
+        return {'type': 'literal', 'xml:lang': lang, 'value': value}
+
+    def uri(path):
+        return {'type': 'uri',
+                'value': 'http://kaiko.getalp.org/dbnary/' + path}
+
+    bindings = []
+    for i in range(rows):
+        word = words[i % len(words)]
+        trans = rand.choice(words)
+        bindings.append({
+            'lexentry': uri('deu/{}__noun__{}'.format(word, i)),
+            'sense_num': {
+                'type': 'typed-literal', 'value': str(i % 5 + 1),
+                'datatype': 'http://www.w3.org/2001/XMLSchema#integer'},
+            'sense': literal(' '.join(rand.sample(words, 5)), 'de'),
+            'trans_entity': uri('deu/__tr_eng_{}_{}'.format(i, trans)),
+            'trans': literal(trans, 'en'),
+        })
+    return ResultSet(list(bindings[0]) if bindings else [], bindings)
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like Virtuoso
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path != '/sparql':
+            self.send_error(404)
+            return
+        query = parse_qs(url.query).get('query', [''])[0]
+        match = page_re.search(query)
+        if match:
+            offset, limit = (int(x) for x in match.groups())
+        else:
+            offset, limit = 0, len(self.server.results.rows)
+        body = self.server.results.page(offset, limit)
+
+        time.sleep(self.server.latency)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/sparql-results+json')
+        if (self.server.gzip and
+                'gzip' in self.headers.get('Accept-Encoding', '')):
+            body = gzip.compress(body, compresslevel=1)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.write_throttled(body)
+
+    def write_throttled(self, body):
+        start = time.perf_counter()
+        for pos in range(0, len(body), CHUNK_SIZE):
+            self.wfile.write(body[pos:pos + CHUNK_SIZE])
+            if self.server.bandwidth:
+                ahead = (pos + CHUNK_SIZE) / self.server.bandwidth - (
+                    time.perf_counter() - start)
+                if ahead > 0:
+                    time.sleep(ahead)
+
+    def log_message(self, *args):
+        if self.server.verbose:
+            super().log_message(*args)
+
+
+def make_server(results, port=0, latency=0, bandwidth=None, gzip=False,
+                verbose=False):
+    """ Server for `results`, call `serve_forever` to start it
+
+    `bandwidth` is in bytes per second. With `port=0` a free port is used,
+    see `server_port`.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), ReplayHandler)
+    server.daemon_threads = True
+    server.results = results
+    server.latency = latency
+    server.bandwidth = bandwidth
+    server.gzip = gzip
+    server.verbose = verbose
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--rows', type=int, default=100000,
+                        help='number of synthetic translation results')
+    source.add_argument('--replay', metavar='FILE',
+                        help='JSON response recorded from Virtuoso')
+    parser.add_argument('--port', type=int, default=8890,
+                        help='0 to pick a free port')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='seconds before each response')
+    parser.add_argument('--bandwidth', type=float,
+                        help='MB per second for each response')
+    parser.add_argument('--gzip', action='store_true',
+                        help='compress responses if the client accepts it')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    if args.replay:
+        with open(args.replay, 'rb') as f:
+            results = ResultSet.from_response(f.read())
+    else:
+        results = synthetic_results(args.rows)
+    server = make_server(
+        results, args.port, args.latency,
+        args.bandwidth and args.bandwidth * 1e6, args.gzip, args.verbose)
+    # The fetch benchmark reads the URL from the first line
+    print('http://127.0.0.1:%s' % server.server_port, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+if __name__ == '__main__':
+    main()
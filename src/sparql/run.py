@@ -1,13 +1,16 @@
 #!/usr/bin/env python3
+import sqlite3
 
+from helper import supported_langs
 from . import queries as sparql
+from . import transport
 
 
 def make_translation(from_lang, to_lang, **kwargs):
     sparql.get_query('translation', query, from_lang=from_lang, to_lang=to_lang)
 
 
-def make_raw(lang, only):
+def make_raw(lang, only, resume=False):
     queries = {
             'form': sparql.form_query,
             'entry': sparql.basic_entry_query,
@@ -18,29 +21,76 @@ def make_raw(lang, only):
     }
     for name, q in queries.items():
         if not only or only == name:
-            sparql.get_query(name, q, lang=lang)
+            sparql.get_query(name, q, resume, lang=lang)
+    # Only reached if all fetches succeeded, see `add_lexentry_ids`
+    convert_raw_db(lang)
 
 
-def make_raw_pair(from_lang, to_lang, only):
+def convert_raw_db(lang):
+    """ Add the lexentry ids and indexes to a fetched raw language db """
+    conn = sqlite3.connect('dictionaries/raw/%s.sqlite3' % lang)
+    sparql.add_lexentry_ids(conn)
+    sparql.create_raw_indexes(conn)
+    conn.close()
+
+
+def make_raw_pair(from_lang, to_lang, only, resume=False):
     trans_q_type = sparql.translation_query_type[from_lang]
     queries = {
             'translation': sparql.translation_query[trans_q_type]
     }
     for name, q in queries.items():
         if not only or only == name:
-            sparql.get_query(name, q, from_lang=from_lang, to_lang=to_lang)
+            sparql.get_query(name, q, resume, from_lang=from_lang,
+                             to_lang=to_lang)
+
+
+def make_raw_all_pairs(from_lang, only, resume=False):
+    """ Fetch the translations into all supported languages at once """
+    to_langs = [lang for lang in supported_langs if lang != from_lang]
+    trans_q_type = sparql.translation_query_type[from_lang]
+    queries = {
+            'translation': sparql.all_targets_translation_query(
+                trans_q_type, to_langs)
+    }
+    for name, q in queries.items():
+        if not only or only == name:
+            sparql.get_split_query(name, q, from_lang, to_langs, resume)
 
 
-def do(lang, only, **kwargs):
+def do(lang, only, resume, http_timeout, retries, convert_ids=False,
+       **kwargs):
+    if convert_ids:
+        if '-' in lang:
+            raise Exception('Only language dbs have lexentry ids, not ' + lang)
+        convert_raw_db(lang)
+        return
+    if (http_timeout, retries) != (sparql.transport.timeout,
+                                   sparql.transport.retries):
+        sparql.transport = transport.Transport(http_timeout, retries)
     if '-' not in lang:
-        make_raw(lang, only)
+        make_raw(lang, only, resume)
+    elif lang.endswith('-all'):
+        make_raw_all_pairs(lang.split('-')[0], only=only, resume=resume)
     else:
-        make_raw_pair(*lang.split('-'), only=only)
+        make_raw_pair(*lang.split('-'), only=only, resume=resume)
 
 
 def add_subparsers(subparsers):
     raw = subparsers.add_parser(
         'raw', help='execute sparql queries and create raw db')
-    raw.add_argument('lang')
+    raw.add_argument('lang', nargs='+',
+                     help='language, pair or `<lang>-all` for the '
+                          'translations into all supported languages')
     raw.set_defaults(func=do)
     raw.add_argument('--only')
+    raw.add_argument('--resume', action='store_true',
+                     help='continue interrupted fetches after their last page '
+                          'and skip complete ones')
+    raw.add_argument('--convert-ids', action='store_true',
+                     help='only add the lexentry ids and indexes to dbs '
+                          'fetched before they were introduced')
+    raw.add_argument('--http-timeout', type=float, default=transport.TIMEOUT,
+                     help='seconds without data before a request is retried')
+    raw.add_argument('--retries', type=int, default=transport.RETRIES,
+                     help='retries after connection errors and 5xx responses')
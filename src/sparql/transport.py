@@ -0,0 +1,123 @@
+""" HTTP transport for the SPARQL fetches
+
+A `Transport` keeps one persistent connection per host, so that the pages
+of a query do not each pay for a new TCP connection. It asks for gzip or
+deflate compressed bodies, which shrinks Virtuoso's verbose JSON a lot, and
+decodes them while reading. Connection errors, timeouts and transient 5xx
+responses are retried with exponential backoff, so that a single hiccup
+does not abort a fetch which has been running for hours.
+"""
+import sys
+import time
+import zlib
+import http.client
+from urllib.parse import urlsplit
+
+TIMEOUT = 1800  # seconds without data before a request fails
+RETRIES = 5
+BACKOFF = 2.0  # seconds before the first retry, doubled for each next one
+RETRY_STATUS = {500, 502, 503, 504}
+
+
+class HTTPError(Exception):
+    """ Non-transient error response, or the last one after all retries """
+
+    def __init__(self, url, status, reason, body):
+        super().__init__('HTTP {} {} for {}'.format(status, reason, url))
+        self.status = status
+        self.body = body
+
+
+class DecodedResponse:
+    """ File-like wrapper decoding a gzip or deflate compressed response """
+
+    def __init__(self, response):
+        self.response = response
+        encoding = response.getheader('Content-Encoding', '').lower()
+        if encoding in ('gzip', 'deflate'):
+            # Accepts gzip and zlib headers. Raw deflate streams, which some
+            # servers send as "deflate", are detected at the first chunk.
+            self.decompressor = zlib.decompressobj(32 + zlib.MAX_WBITS)
+        else:
+            self.decompressor = None
+        self.first_chunk = True
+
+    def read(self, size=None):
+        if not self.decompressor:
+            return self.response.read(size)
+        while True:
+            raw = self.response.read(size)
+            if not raw:
+                return self.decompressor.flush()
+            try:
+                data = self.decompressor.decompress(raw)
+            except zlib.error:
+                if not self.first_chunk:
+                    raise
+                self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+                data = self.decompressor.decompress(raw)
+            self.first_chunk = False
+            if data:
+                return data
+
+
+class Transport:
+
+    def __init__(self, timeout=TIMEOUT, retries=RETRIES, backoff=BACKOFF):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.connections = {}
+
+    def connection(self, scheme, netloc):
+        if (scheme, netloc) not in self.connections:
+            conn_class = (http.client.HTTPSConnection if scheme == 'https'
+                          else http.client.HTTPConnection)
+            self.connections[scheme, netloc] = conn_class(
+                netloc, timeout=self.timeout)
+        return self.connections[scheme, netloc]
+
+    def close(self):
+        for conn in self.connections.values():
+            conn.close()
+        self.connections = {}
+
+    def request(self, url, read):
+        parts = urlsplit(url)
+        conn = self.connection(parts.scheme, parts.netloc)
+        path = parts.path + ('?' + parts.query if parts.query else '')
+        try:
+            conn.request('GET', path or '/', headers={
+                'Accept-Encoding': 'gzip, deflate',
+            })
+            response = conn.getresponse()
+            if response.status != 200:
+                body = response.read()
+                raise HTTPError(url, response.status, response.reason, body)
+            return read(DecodedResponse(response))
+        except Exception:
+            # The connection is in an unknown state, use a new one next time
+            conn.close()
+            raise
+
+    def fetch(self, url, read=lambda response: response.read()):
+        """ GET `url` and return `read(response)`
+
+        Reading the body is part of the retried operation, since a
+        connection can also break in the middle of a large page.
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                return self.request(url, read)
+            except HTTPError as e:
+                if e.status not in RETRY_STATUS or attempt == self.retries:
+                    raise
+                error = e
+            except (OSError, http.client.HTTPException) as e:
+                if attempt == self.retries:
+                    raise
+                error = e
+            delay = self.backoff * 2 ** attempt
+            print('{}, retrying in {:.0f}s'.format(error, delay),
+                  file=sys.stderr, flush=True)
+            time.sleep(delay)
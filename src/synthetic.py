@@ -0,0 +1,122 @@
+""" Generate synthetic raw dbs shaped like the dbnary SPARQL results
+
+All languages share the same set of concepts. Concept `i` gets a random
+word in every language and translations connect the words of the same
+concept, so that inference across languages finds something to do.
+"""
+import os
+import random
+import sqlite3
+from itertools import permutations
+
+from languages import language_codes3
+from sparql.queries import (
+    translation_query_type, add_lexentry_ids, create_raw_indexes)
+
+SQL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'sql', 'sparql')
+LANG_TABLES = ['entry', 'pos', 'gender', 'pronun', 'form', 'importance']
+POS = ['noun', 'noun', 'noun', 'verb', 'verb', 'adjective', 'adverb']
+GENDERS = ['masculine', 'feminine', 'neuter']
+SYLLABLES = [c + v for c in 'bdfghklmnprstvwz' for v in 'aeiou'] + [
+    c + v + e for c in 'bkmst' for v in 'aiu' for e in 'nrs']
+
+
+def create_table(conn, table_name):
+    with open(os.path.join(SQL_PATH, table_name + '.sql')) as f:
+        conn.executescript(f.read())
+
+
+def make_words(lang, vocab_size, rand):
+    words = set()
+    result = []
+    while len(result) < vocab_size:
+        word = ''.join(rand.choice(SYLLABLES)
+                       for _ in range(rand.randint(1, 4)))
+        if word in words:
+            continue
+        words.add(word)
+        result.append(word.capitalize() if lang == 'de' else word)
+    return result
+
+
+def lexentry(lang, word, pos):
+    return '{}/{}__{}__1'.format(language_codes3[lang], word, pos)
+
+
+def make_raw_lang(path, lang, words, rand):
+    lang3 = language_codes3[lang]
+    conn = sqlite3.connect(path)
+    for table in LANG_TABLES:
+        create_table(conn, table)
+    for i, word in enumerate(words):
+        pos = POS[i % len(POS)]
+        entry = lexentry(lang, word, pos)
+        conn.execute("INSERT INTO entry VALUES (?, ?, ?)",
+                     [entry, lang3 + '/' + word, word])
+        conn.execute("INSERT INTO pos VALUES (?, ?)", [entry, pos])
+        conn.execute("INSERT INTO pronun VALUES (?, ?)",
+                     [entry, '/' + word.lower() + '/'])
+        # importance roughly follows Zipf's law
+        conn.execute("INSERT INTO importance VALUES (?, ?)",
+                     [lang3 + '/' + word, 100 / (i + 1) ** 0.5])
+        if pos == 'noun':
+            conn.execute("INSERT INTO gender VALUES (?, ?)",
+                         [entry, rand.choice(GENDERS)])
+            for case in ['Nominative', 'Genitive']:
+                for number, suffix in [('Singular', ''), ('Plural', 'en')]:
+                    conn.execute(
+                        "INSERT INTO form VALUES (?, ?, ?, ?, ?, ?)",
+                        [entry, word + suffix + ('s' if case == 'Genitive'
+                                                 else ''),
+                         case, number, None, pos])
+        elif pos == 'verb':
+            for suffix in ['t', 'te', 'end']:
+                conn.execute(
+                    "INSERT INTO form VALUES (?, ?, ?, ?, ?, ?)",
+                    [entry, word + suffix, None, None, None, pos])
+    conn.commit()
+    add_lexentry_ids(conn)
+    create_raw_indexes(conn)
+    conn.close()
+
+
+def make_raw_pair(path, from_lang, to_lang, from_words, to_words, rand,
+                  density, gloss_length):
+    conn = sqlite3.connect(path)
+    create_table(conn, 'translation')
+    with_sense_num = translation_query_type[from_lang] == 'sense'
+    gloss_words = from_words[:1000]
+    for i, word in enumerate(from_words):
+        if rand.random() >= density:
+            continue
+        entry = lexentry(from_lang, word, POS[i % len(POS)])
+        for sense_num in range(1, rand.randint(1, 3) + 1):
+            gloss = ' '.join(rand.choice(gloss_words)
+                             for _ in range(gloss_length))
+            # the right translation, plus some noise from other concepts
+            translations = [to_words[i]] + [
+                rand.choice(to_words) for _ in range(rand.randint(0, 2))]
+            for trans in translations:
+                conn.execute(
+                    "INSERT INTO translation VALUES (?, ?, ?, ?, ?)",
+                    [entry, str(sense_num) if with_sense_num else '',
+                     gloss, 'trans/' + trans, trans])
+    conn.commit()
+    conn.close()
+
+
+def make_raw_dbs(path, langs, vocab_size=10000, density=0.5, gloss_length=5,
+                 seed=0):
+    """ Create raw dbs for all `langs` and pairs between them in `path` """
+    rand = random.Random(seed)
+    os.makedirs(path, exist_ok=True)
+    words = {lang: make_words(lang, vocab_size, rand) for lang in langs}
+    for lang in langs:
+        make_raw_lang(os.path.join(path, lang + '.sqlite3'),
+                      lang, words[lang], rand)
+    for from_lang, to_lang in permutations(langs, 2):
+        make_raw_pair(
+            os.path.join(path, '{}-{}.sqlite3'.format(from_lang, to_lang)),
+            from_lang, to_lang, words[from_lang], words[to_lang], rand,
+            density, gloss_length)
@@ -1,15 +1,20 @@
 #!/usr/bin/env python3
+import os
 import sys
+import json
+import time
 import sqlite3
 import datetime
-import codecs
-from itertools import groupby, permutations
+import hashlib
+from itertools import groupby, combinations
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from xml.etree.cElementTree import (
     Element, SubElement, tostring, XML, register_namespace)
 from collections import OrderedDict
 
 from languages import language_names, language_codes3
-from helper import supported_langs
+from helper import supported_langs, compressors
+import manifest
 
 
 def indent(elem, level=0):
@@ -139,7 +144,20 @@ def list_split(l):
     return l.split(' | ')
 
 
-def get_translations(from_lang, to_lang):
+# Joins the pair's translations with their entries, see `open_translations`
+translations_from = """
+    FROM translation_grouped t
+         JOIN prod_lang.entry e USING (lexentry)
+    WHERE score >= ?
+"""
+
+
+def open_translations(from_lang, to_lang):
+    """ Connect to the dbs of a pair and determine the minimum score
+
+    Returns the connection, the number of good translations and the minimum
+    translation score for `translations_from`.
+    """
     conn = sqlite3.connect(
         'file:dictionaries/generic/%s-%s.sqlite3?mode=ro'
         % (from_lang, to_lang),
@@ -155,17 +173,35 @@ def get_translations(from_lang, to_lang):
     min_translation_score = round(
         (good_translations - 1000) / expected_good_translations * 100)
     min_translation_score = max(min(min_translation_score, 100), 0)
+    return conn, good_translations, min_translation_score
+
+
+def count_headwords(from_lang, to_lang):
+    """ Number of entries `get_translations` will yield """
+    conn, _, min_translation_score = open_translations(from_lang, to_lang)
+    count = conn.execute("""
+        SELECT count(*) FROM (
+            SELECT DISTINCT t.written_rep, e.part_of_speech, e.gender,
+                e.pronun_list
+            {}
+        )
+    """.format(translations_from), [min_translation_score]).fetchone()[0]
+    conn.close()
+    return count
+
+
+def get_translations(from_lang, to_lang):
+    conn, good_translations, min_translation_score = open_translations(
+        from_lang, to_lang)
     print('{} good translations, min_score = {}'.format(
         good_translations, min_translation_score))
     translations = conn.execute("""
         SELECT lexentry,
             t.written_rep, t.sense_list, t.trans_list,
             e.gender, e.part_of_speech, e.pronun_list
-        FROM translation_grouped t
-             JOIN prod_lang.entry e USING (lexentry)
-        WHERE score >= ?
+        {}
         ORDER BY t.written_rep, e.part_of_speech, e.gender, e.pronun_list, t.min_sense_num
-    """, [min_translation_score])
+    """.format(translations_from), [min_translation_score])
     groups = groupby(translations,
                      lambda t: (t['written_rep'], t['part_of_speech'],
                                 t['gender'], t['pronun_list']))
@@ -210,6 +246,21 @@ def add_senses(entry, x, to_lang, is_suffix):
 
 
 
+def orth_and_pos(x):
+    """ Return (orth text, pos text, is_suffix) for an entry """
+    is_suffix = (
+        x['part_of_speech'] == 'suffix' or
+        (x['part_of_speech'] in ('', None)
+         and x['written_rep'].startswith('-'))
+    )
+    if is_suffix:
+        #assert x['written_rep'].startswith('-')
+        return x['written_rep'][1:], 'suffix', is_suffix
+    pos_text = pos_mapping.get(x['part_of_speech'],
+                               (x['part_of_speech'], None))[0]
+    return x['written_rep'], pos_text, is_suffix
+
+
 def single_tei_entry(x, to_lang):
     # entry
     entry = Element('entry')
@@ -219,19 +270,7 @@ def single_tei_entry(x, to_lang):
         for p in x['pronuns']:
             pron = SubElement(form, 'pron')
             pron.text = p
-    is_suffix = (
-        x['part_of_speech'] == 'suffix' or
-        (x['part_of_speech'] in ('', None)
-         and x['written_rep'].startswith('-'))
-    )
-    if is_suffix:
-        #assert x['written_rep'].startswith('-')
-        orth.text = x['written_rep'][1:]
-        pos_text = 'suffix'
-    else:
-        orth.text = x['written_rep']
-        pos_text = pos_mapping.get(x['part_of_speech'],
-                                   (x['part_of_speech'], None))[0]
+    orth.text, pos_text, is_suffix = orth_and_pos(x)
 
     # gramGrp
     gram_grp = Element('gramGrp')
@@ -249,40 +288,96 @@ def single_tei_entry(x, to_lang):
     return entry
 
 
-def get_tei_entries_as_xml(from_lang, to_lang):
-    """ Get all entries as xml string
+def xml_escape(text):
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
 
-    Keeping them as XML objects would use much more memory
+def xml_element(tag, level, children=(), text=None, attrs=''):
+    """ Serialize an element like `indent` followed by `tostring` would
+
+    `children` are already serialized elements without their tails.
+    """
+    if children:
+        sep = '\n' + (level + 1) * '  '
+        return '<{0}{1}>{2}{3}\n{4}</{0}>'.format(
+            tag, attrs, sep, sep.join(children), level * '  ')
+    if text:
+        return '<{0}{1}>{2}</{0}>'.format(tag, attrs, xml_escape(text))
+    return '<{0}{1} />'.format(tag, attrs)
+
+
+def tei_entry_text(x, to_lang, level=2):
+    """ Serialize an entry directly to indented xml text
+
+    Gives the same output as `single_tei_entry` followed by `indent` and
+    `tostring`, but without building an element tree.
+    """
+    orth_text, pos_text, is_suffix = orth_and_pos(x)
+    form = [xml_element('orth', level + 2, text=orth_text)]
+    for p in x['pronuns']:
+        form.append(xml_element('pron', level + 2, text=p))
+    children = [xml_element('form', level + 1, form)]
+
+    gram_grp = []
+    if pos_text:
+        gram_grp.append(xml_element('pos', level + 2, text=pos_text))
+    if x['gender']:
+        gram_grp.append(xml_element(
+            'gen', level + 2, text=gender_mapping[x['gender']]))
+    if gram_grp:
+        children.append(xml_element('gramGrp', level + 1, gram_grp))
+
+    cit_attrs = ' type="trans" xml:lang="{}"'.format(to_lang)
+    for trans_list, subsenses in groupby(x['senses'],
+                                         lambda s: (s['trans_list'])):
+        quotes = []
+        for trans in trans_list:
+            assert trans, 'empty translation for %r' % x
+            if is_suffix:
+                trans = trans[1:]
+            quotes.append(xml_element('quote', level + 3, text=trans))
+        sense = [xml_element('cit', level + 2, quotes, attrs=cit_attrs)]
+        for s in subsenses:
+            if s['gloss']:
+                sense_def = xml_element('def', level + 3, text=s['gloss'])
+                sense.append(xml_element('sense', level + 2, [sense_def]))
+        children.append(xml_element('sense', level + 1, sense))
+
+    return xml_element('entry', level, children) + '\n' + level * '  '
+
+
+def tei_entry_text_etree(x, to_lang):
+    """ Reference serialization using ElementTree, see `tei_entry_text` """
+    entry = single_tei_entry(x, to_lang)
+    indent(entry, level=2)
+    return tostring(entry, 'utf-8').decode('utf-8')
+
+
+def write_tei_entries(out_file, from_lang, to_lang):
+    """ Write all entries as xml to `out_file` and return their number
+
+    Entries are written as soon as they are serialized, so that memory usage
+    does not depend on the size of the dictionary.
     """
-    conn = sqlite3.connect(
-        'dictionaries/generic/%s.sqlite3'
-        % from_lang)
-    conn.row_factory = sqlite3.Row
-    entries_xml_text_list = []
     headwords = 0
     for x in get_translations(from_lang, to_lang):
-        entry = single_tei_entry(x, to_lang)
-
-        indent(entry, level=2)
-        entries_xml_text_list.append(
-            tostring(entry, 'utf-8').decode('utf-8')
-        )
+        out_file.write(tei_entry_text(x, to_lang))
         headwords += 1
         if headwords % 2000 == 0:
             print('.', end='', flush=True)
     print()
 
-    entries_xml_text = ''.join(entries_xml_text_list)
-    return entries_xml_text, headwords
+    return headwords
 
 
-def write_tei_dict(from_lang, to_lang):
+def write_tei_dict(from_lang, to_lang, compression=None):
     print(from_lang, to_lang)
     pos_usage = ''.join('<item ana="{1}">{0}</item>'.format(*pos)
                         for pos in list(pos_mapping.values()))
 
-    # get entries, this is where most work is done
-    entries, headwords = get_tei_entries_as_xml(from_lang, to_lang)
+    # The header needs the number of headwords, so count them first. The
+    # entries are then streamed directly into the (compressed) output.
+    headwords = count_headwords(from_lang, to_lang)
     if headwords == 0:
         return
 
@@ -306,45 +401,200 @@ def write_tei_dict(from_lang, to_lang):
     ))
     indent(tei_template_xml)
 
-    # render xml and add entries
+    # render xml and split at the position of the entries
     rendered_template = tostring(tei_template_xml, 'utf-8').decode('utf-8')
-    complete_tei = rendered_template.format(
-        entries=entries,
-    )
+    header, footer = rendered_template.split('{entries}')
 
     # write to file and add declarations
     out_filename = 'dictionaries/tei/{}{}-{}.tei'.format(
         'small/' if headwords < 5000 else '',
         language_codes3[from_lang],
         language_codes3[to_lang])
-    with codecs.open(out_filename, 'w', 'utf-8') as out_file:
-        out_file.write("""
+    if compression:
+        out_filename += '.' + compression
+    # Only complete files get the final name, which is published
+    tmp_filename = out_filename + '.tmp'
+    open_output = compressors[compression] if compression else open
+    try:
+        with open_output(tmp_filename, 'wt', encoding='utf-8',
+                         newline='') as out_file:
+            out_file.write("""
 <?xml version="1.0" encoding="UTF-8"?>
 <?xml-stylesheet type="text/css" href="freedict-dictionary.css"?>
 <?oxygen RNGSchema="freedict-P5.rng" type="xml"?>
 <!DOCTYPE TEI SYSTEM "freedict-P5.dtd">
-        """.strip() + '\n')
-        out_file.write(complete_tei)
-
-
-def write_dict_pair(from_lang, to_lang):
-    write_tei_dict(from_lang, to_lang)
-    write_tei_dict(to_lang, from_lang)
+            """.strip() + '\n')
+            out_file.write(header)
+            written = write_tei_entries(out_file, from_lang, to_lang)
+            out_file.write(footer)
+        assert written == headwords, \
+            'counted {} headwords, but wrote {}'.format(headwords, written)
+    except BaseException:
+        os.remove(tmp_filename)
+        raise
+    os.replace(tmp_filename, out_filename)
+
+    return out_filename
+
+
+def write_dict_pair(from_lang, to_lang, compression=None):
+    """ Export both directions and return the written files """
+    written = [write_tei_dict(from_lang, to_lang, compression),
+               write_tei_dict(to_lang, from_lang, compression)]
+    return [path for path in written if path]
+
+
+# Not in dictionaries/tei, which is published as a whole
+export_state_filename = 'dictionaries/tei_export_state.json'
+
+
+def input_state(from_lang, to_lang):
+    """ Modification times and sizes of all dbs used to export a pair """
+    paths = [
+        'dictionaries/generic/%s-%s.sqlite3' % (from_lang, to_lang),
+        'dictionaries/generic/%s-%s.sqlite3' % (to_lang, from_lang),
+        'dictionaries/wdweb/%s.sqlite3' % from_lang,
+        'dictionaries/wdweb/%s.sqlite3' % to_lang,
+    ]
+    state = {}
+    for path in paths:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            state[path] = [stat.st_mtime, stat.st_size]
+    return state
+
+
+def output_state(outputs):
+    """ Modification times and sizes of the exported files """
+    state = {}
+    for path in outputs:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            state[path] = [stat.st_mtime, stat.st_size]
+    return state
+
+
+def source_hash():
+    """ Hash of the source files of the export """
+    h = hashlib.sha256()
+    for path in manifest.source_files([sys.modules[__name__]]):
+        with open(path, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def timed_write_dict_pair(from_lang, to_lang, compression=None):
+    start = time.perf_counter()
+    outputs = write_dict_pair(from_lang, to_lang, compression)
+    return time.perf_counter() - start, outputs
+
+
+def write_all_pairs(jobs=None, force=False, compression=None):
+    """ Export all language pairs using a pool of `jobs` processes
+
+    Each pair is only exported once, since `write_dict_pair` writes both
+    directions. Pairs are skipped unless `force` is set, their input dbs,
+    the compression or the export code changed, or the exported files were
+    modified or removed. A failing pair does not stop the other ones.
+    """
+    try:
+        with open(export_state_filename) as f:
+            export_state = json.load(f)
+    except FileNotFoundError:
+        export_state = {}
+
+    source = source_hash()
+    todo = {}
+    for from_lang, to_lang in combinations(supported_langs, 2):
+        pair = from_lang + '-' + to_lang
+        state = dict(inputs=input_state(from_lang, to_lang),
+                     compression=compression, source=source)
+        previous = export_state.get(pair, {})
+        outputs = previous.get('outputs', {})
+        unchanged = (
+            {k: v for k, v in previous.items() if k != 'outputs'} == state
+            and output_state(outputs) == outputs)
+        if force or not unchanged:
+            todo[pair] = state
+    print('Exporting {} pairs, {} unchanged'.format(
+        len(todo), len(list(combinations(supported_langs, 2))) - len(todo)))
+
+    failed = []
+    with ProcessPoolExecutor(jobs) as pool:
+        futures = {
+            pool.submit(timed_write_dict_pair, *pair.split('-'),
+                        compression=compression): pair
+            for pair in todo
+        }
+        for i, future in enumerate(as_completed(futures), 1):
+            pair = futures[future]
+            try:
+                duration, outputs = future.result()
+            except Exception as e:
+                print('[{}/{}] {} failed: {!r}'.format(
+                    i, len(todo), pair, e), flush=True)
+                failed.append(pair)
+                export_state.pop(pair, None)
+                continue
+            print('[{}/{}] {} done in {:.0f}s'.format(
+                i, len(todo), pair, duration), flush=True)
+            # save after every pair, so that an aborted run can be resumed
+            export_state[pair] = dict(todo[pair],
+                                      outputs=output_state(outputs))
+            with open(export_state_filename, 'w') as f:
+                json.dump(export_state, f, indent=1, sort_keys=True)
+
+    if failed:
+        raise Exception('Export failed for ' + ', '.join(sorted(failed)))
+
+
+def check_serializers(from_lang, to_lang):
+    """ Compare output and speed of both entry serializers for a pair """
+    entries = list(get_translations(from_lang, to_lang))
+    mismatches = 0
+    for x in entries:
+        if tei_entry_text(x, to_lang) != tei_entry_text_etree(x, to_lang):
+            mismatches += 1
+            if mismatches <= 10:
+                print('Mismatch for', x['written_rep'])
+    print('{} of {} entries differ'.format(mismatches, len(entries)))
+
+    for serialize in [tei_entry_text_etree, tei_entry_text]:
+        start = time.perf_counter()
+        for x in entries:
+            serialize(x, to_lang)
+        duration = time.perf_counter() - start
+        print('{}: {:.0f} entries/sec'.format(
+            serialize.__name__, len(entries) / duration))
 
 
 def main():
-    if len(sys.argv) == 2 and sys.argv[1] == 'all':
-        for from_lang, to_lang in permutations(supported_langs, 2):
-            write_dict_pair(from_lang, to_lang)
-    elif len(sys.argv) == 3:
-        from_lang, to_lang = sys.argv[1:]
+    import argparse
+    parser = argparse.ArgumentParser(
+        usage='%(prog)s [options] FROM_LANG TO_LANG\n'
+              '       %(prog)s [options] all\n'
+              '       %(prog)s check FROM_LANG TO_LANG')
+    parser.add_argument('args', nargs='+', help=argparse.SUPPRESS)
+    parser.add_argument('--compress', choices=sorted(compressors),
+                        help='write compressed TEI files')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(),
+                        help='number of pairs exported in parallel by "all"')
+    parser.add_argument('--force', action='store_true',
+                        help='"all" also exports pairs with unchanged inputs')
+    args = parser.parse_args()
+
+    if len(args.args) == 3 and args.args[0] == 'check':
+        check_serializers(*args.args[1:])
+    elif args.args == ['all']:
+        write_all_pairs(args.jobs, args.force, args.compress)
+    elif len(args.args) == 2:
+        from_lang, to_lang = args.args
         #import cProfile
         #cProfile.run('write_dict_pair(from_lang, to_lang)', sort='cumtime')
-        #cProfile.run('get_tei_entries_as_xml("de", "fr")', sort='tottime')
-        write_dict_pair(from_lang, to_lang)
+        #cProfile.run('write_tei_entries(sys.stdout, "de", "fr")', sort='tottime')
+        write_dict_pair(from_lang, to_lang, args.compress)
     else:
-        print('Usage: %s [FROM_LANG] [TO_LANG]' % sys.argv[0])
-        print('    or %s all' % sys.argv[0])
+        parser.print_usage()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,41 @@
+# vim: set fileencoding=utf-8 :
+import unittest
+import sqlite3
+
+from fuzzy import make_fuzzy_index, suggest, levenshtein
+
+
+class TestFuzzy(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        self.conn.executescript("""
+            CREATE TABLE entry (written_rep text);
+            CREATE TABLE rel_importance (vocable text, rel_score real);
+            INSERT INTO entry VALUES ('Haus'), ('Maus'), ('Hase'), ('Baum');
+            INSERT INTO rel_importance VALUES
+                ('deu/Haus', 1.0), ('deu/Maus', 0.5),
+                ('deu/Hase', 0.2), ('deu/Baum', 0.8);
+        """)
+        make_fuzzy_index(self.conn, 'de')
+
+    def test_levenshtein(self):
+        self.assertEqual(levenshtein('Haus', 'Haus'), 0)
+        self.assertEqual(levenshtein('Haus', 'Hau'), 1)
+        self.assertEqual(levenshtein('Haus', 'Maus'), 1)
+        self.assertEqual(levenshtein('Haus', 'Hase'), 2)
+
+    def test_suggest(self):
+        self.assertEqual(
+            [w for w, _, _ in suggest(self.conn, 'haus')],
+            ['Haus', 'Maus', 'Hase']
+        )
+        self.assertEqual(
+            [w for w, _, _ in suggest(self.conn, 'Naus', max_distance=1)],
+            ['Haus', 'Maus']
+        )
+        self.assertEqual(suggest(self.conn, 'Xylophon'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
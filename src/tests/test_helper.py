@@ -0,0 +1,233 @@
+import os
+import io
+import json
+import unittest
+import sqlite3
+import tempfile
+
+import helper
+
+
+class TestRunTarget(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.orig_build_log = helper.BUILD_LOG
+        helper.BUILD_LOG = os.path.join(self.tmp_dir.name, 'build_log.jsonl')
+
+    def tearDown(self):
+        helper.BUILD_LOG = self.orig_build_log
+        helper.explain_query_plans = False
+        self.tmp_dir.cleanup()
+
+    def test_log(self):
+        def target(conn, lang):
+            conn.executescript("""
+                CREATE TABLE main.numbers AS
+                SELECT value FROM (SELECT 1 AS value UNION SELECT 2);
+                CREATE TABLE other (x);
+                DROP TABLE other;
+            """)
+
+        helper.explain_query_plans = True
+        conn = sqlite3.connect(':memory:')
+        helper.run_target(conn, 'de', 'processed', 'numbers', target)
+        with open(helper.BUILD_LOG) as f:
+            record = json.loads(f.readline())
+        self.assertEqual(record['target'], 'numbers')
+        self.assertEqual(record['lang'], 'de')
+        self.assertEqual(record['rows'], {'numbers': 2})
+        self.assertEqual(record['build_profile'], 'default')
+        self.assertGreater(record['peak_memory_mb'], 0)
+        self.assertEqual(record['query_plans'][0]['sql'],
+                         'CREATE TABLE main.numbers AS SELECT value FROM '
+                         '(SELECT 1 AS value UNION SELECT 2);')
+        self.assertTrue(record['query_plans'][0]['plan'])
+
+    def test_commented_statements(self):
+        def target(conn, lang):
+            conn.executescript("""
+                -- make table
+                CREATE TEMP TABLE tmp AS SELECT 1 AS value;
+                /* copy it */
+                CREATE TABLE main.numbers AS SELECT value FROM tmp;
+                DROP TABLE tmp;
+            """)
+
+        helper.explain_query_plans = True
+        conn = sqlite3.connect(':memory:')
+        helper.run_target(conn, 'de', 'processed', 'numbers', target)
+        with open(helper.BUILD_LOG) as f:
+            record = json.loads(f.readline())
+        self.assertEqual(record['rows'], {'numbers': 1})
+        plans = {p['sql']: p['plan'] for p in record['query_plans']}
+        # explained before tmp was dropped
+        self.assertEqual(
+            plans['/* copy it */ CREATE TABLE main.numbers AS '
+                  'SELECT value FROM tmp;'],
+            ['SCAN tmp'])
+        self.assertEqual(len(plans), 2)
+
+    def test_sql_tracer(self):
+        out = io.StringIO()
+        helper.sql_tracer = helper.SQLTracer(out)
+        conn = sqlite3.connect(':memory:')
+        try:
+            helper.run_target(
+                conn, 'de', 'processed', 'numbers',
+                lambda conn, lang: conn.execute('CREATE TABLE numbers (x)'))
+        finally:
+            helper.sql_tracer = None
+        # both the tracer and the build log see the statement
+        self.assertIn('CREATE TABLE numbers (x)', out.getvalue())
+        with open(helper.BUILD_LOG) as f:
+            self.assertEqual(json.loads(f.readline())['rows'],
+                             {'numbers': 0})
+
+
+class TestAttach(unittest.TestCase):
+
+    def test_reuse(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            first = os.path.join(tmp_dir, 'first.sqlite3')
+            second = os.path.join(tmp_dir, 'second.sqlite3')
+            statements = []
+            conn = sqlite3.connect(':memory:')
+            conn.set_trace_callback(statements.append)
+            helper.attach_db(conn, first, 'lang')
+            helper.attach_db(conn, first, 'lang')
+            self.assertEqual(
+                [s for s in statements if s.startswith('ATTACH')],
+                ["ATTACH DATABASE '%s' AS lang" % first])
+
+            helper.attach_db(conn, second, 'lang')
+            attached = {row[1]: row[2]
+                        for row in conn.execute('PRAGMA database_list')}
+            self.assertEqual(os.path.realpath(attached['lang']),
+                             os.path.realpath(second))
+            conn.close()
+
+    def test_stage_in_memory(self):
+        helper.memory_staging_limit = 1
+        self.addCleanup(setattr, helper, 'memory_staging_limit', 0)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            self.addCleanup(helper.staged_dbs.clear)
+            self.addCleanup(setattr, helper, 'BUILD_LOG', helper.BUILD_LOG)
+            helper.BUILD_LOG = os.path.join(tmp_dir, 'build_log.jsonl')
+            path = os.path.join(tmp_dir, 'lang.sqlite3')
+            source = sqlite3.connect(path)
+            source.execute("CREATE TABLE entry AS SELECT 'Haus' AS word")
+            source.commit()
+
+            conn = sqlite3.connect(':memory:')
+            helper.attach_db(conn, path, 'lang', stage=True)
+            attached = {row[1]: row[2]
+                        for row in conn.execute('PRAGMA database_list')}
+            self.assertTrue(attached['lang'].startswith(helper.STAGING_PREFIX))
+            self.assertEqual(conn.execute('SELECT word FROM lang.entry')
+                             .fetchall(), [('Haus',)])
+
+            # changes to the file are copied when it is attached again
+            source.execute("INSERT INTO entry VALUES ('Maus')")
+            source.commit()
+            os.utime(path, (0, 0))
+            helper.attach_db(conn, path, 'lang', stage=True)
+            self.assertEqual(conn.execute('SELECT count(*) FROM lang.entry')
+                             .fetchone()[0], 2)
+            source.close()
+            conn.close()
+
+    def test_release_staged(self):
+        helper.memory_staging_limit = 1
+        self.addCleanup(setattr, helper, 'memory_staging_limit', 0)
+        self.addCleanup(setattr, helper, 'MAX_STAGED_MB', helper.MAX_STAGED_MB)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            self.addCleanup(helper.staged_dbs.clear)
+            self.addCleanup(setattr, helper, 'BUILD_LOG', helper.BUILD_LOG)
+            helper.BUILD_LOG = os.path.join(tmp_dir, 'build_log.jsonl')
+            paths = []
+            for lang in ['de', 'en', 'fr']:
+                path = os.path.join(tmp_dir, lang + '.sqlite3')
+                source = sqlite3.connect(path)
+                source.execute('CREATE TABLE entry AS SELECT ? AS lang',
+                               [lang])
+                source.commit()
+                source.close()
+                paths.append(path)
+            # room for two of the copies
+            helper.MAX_STAGED_MB = 2.5 * os.path.getsize(paths[0]) / 1024 ** 2
+
+            conn = sqlite3.connect(':memory:')
+            helper.attach_db(conn, paths[0], 'lang', stage=True)
+            helper.attach_db(conn, paths[1], 'other', stage=True)
+            helper.attach_db(conn, paths[0], 'lang', stage=True)
+            helper.attach_db(conn, paths[2], 'third', stage=True)
+            # en was used least recently
+            self.assertEqual(list(helper.staged_dbs), [paths[0], paths[2]])
+            # but stays readable while it is attached
+            self.assertEqual(conn.execute('SELECT lang FROM other.entry')
+                             .fetchall(), [('en',)])
+            conn.close()
+
+
+class TestBuildProfile(unittest.TestCase):
+
+    def tearDown(self):
+        helper.build_profile = 'default'
+
+    def test_attached(self):
+        helper.build_profile = 'server'
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            conn = sqlite3.connect(os.path.join(tmp_dir, 'main.sqlite3'))
+            helper.attach_db(conn, os.path.join(tmp_dir, 'lang.sqlite3'),
+                             'lang')
+            helper.apply_build_profile(conn, ['main', 'lang'])
+            for schema in ['main', 'lang']:
+                self.assertEqual(conn.execute(
+                    'PRAGMA %s.cache_size' % schema).fetchone()[0],
+                    -4 * 1024 * 1024)
+            # inputs keep their journal and syncs
+            for schema, journal_mode, synchronous in [
+                    ('main', 'off', 0), ('lang', 'delete', 2)]:
+                self.assertEqual(conn.execute(
+                    'PRAGMA %s.journal_mode' % schema).fetchone()[0],
+                    journal_mode)
+                self.assertEqual(conn.execute(
+                    'PRAGMA %s.synchronous' % schema).fetchone()[0],
+                    synchronous)
+            self.assertEqual(
+                conn.execute('PRAGMA temp_store').fetchone()[0], 2)
+            conn.close()
+
+
+class TestUDFCalls(unittest.TestCase):
+
+    def tearDown(self):
+        helper.count_udf_calls = False
+        helper.udf_calls.clear()
+
+    def test_count(self):
+        class Sum:
+            def __init__(self):
+                self.total = 0
+
+            def step(self, value):
+                self.total += value
+
+            def finalize(self):
+                return self.total
+
+        helper.count_udf_calls = True
+        conn = sqlite3.connect(':memory:')
+        helper.create_function(conn, 'double', 1, lambda x: 2 * x)
+        helper.create_aggregate(conn, 'my_sum', 1, Sum)
+        result = conn.execute("""
+            SELECT my_sum(double(value))
+            FROM (SELECT 1 AS value UNION SELECT 2 UNION SELECT 3)
+        """).fetchone()[0]
+        self.assertEqual(result, 12)
+        self.assertEqual(helper.udf_calls, {'double': 3, 'my_sum': 3})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,7 +2,7 @@
 import unittest
 import sqlite3
 
-from infer import AggByScore
+from infer import AggByScore, prune
 
 
 class TestInfer(unittest.TestCase):
@@ -26,6 +26,24 @@ class TestInfer(unittest.TestCase):
             [('Wohnung | Haus', )]
         )
 
+    def test_prune(self):
+        conn = sqlite3.connect(':memory:')
+        conn.execute("""
+            CREATE TABLE all_trans(from_lang text, to_lang text, sense text)
+        """)
+        conn.executemany("INSERT INTO all_trans VALUES (?, ?, 'x')", [
+            ('de', 'en'), ('en', 'de'), ('de', 'xx'), ('xx', 'en')])
+        prune(conn)
+        self.assertEqual(
+            conn.execute("""
+                SELECT from_lang, to_lang FROM all_trans ORDER BY 1
+            """).fetchall(),
+            [('de', 'en'), ('en', 'de')]
+        )
+
+    def test_prune_empty_db(self):
+        prune(sqlite3.connect(':memory:'))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,89 @@
+import os
+import bz2
+import sys
+import gzip
+import shlex
+import unittest
+import tempfile
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', '..', 'virtuoso'))
+import insert_single_ttl  # noqa: E402
+
+# Appends each isql session to the log and exits with the given status
+STUB_ISQL = """
+import sys
+code = sys.stdin.read()
+with open(sys.argv[1], 'a') as f:
+    f.write(code + '\\n-- end of session\\n')
+sys.exit(int(sys.argv[2]))
+"""
+
+
+class TestRecompress(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.bz2_file = os.path.join(self.tmp_dir.name, 'de_dbnary.ttl.bz2')
+        self.gz_file = self.bz2_file.replace('.bz2', '.gz')
+
+    def test_recompress(self):
+        content = b'<a> <b> <c> .\n' * 1000
+        with bz2.open(self.bz2_file, 'wb') as f:
+            f.write(content)
+        insert_single_ttl.recompress(self.bz2_file)
+        with gzip.open(self.gz_file) as f:
+            self.assertEqual(f.read(), content)
+        self.assertEqual(sorted(os.listdir(self.tmp_dir.name)),
+                         ['de_dbnary.ttl.bz2', 'de_dbnary.ttl.gz'])
+
+    def test_broken_input(self):
+        data = bz2.compress(b'<a> <b> <c> .\n' * 1000)
+        with open(self.bz2_file, 'wb') as f:
+            f.write(data[:len(data) // 2])  # truncated download
+        with self.assertRaises(EOFError):
+            insert_single_ttl.recompress(self.bz2_file)
+        # neither a truncated .gz nor a leftover .tmp file
+        self.assertEqual(os.listdir(self.tmp_dir.name), ['de_dbnary.ttl.bz2'])
+
+
+class TestLoad(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.stub = os.path.join(self.tmp_dir.name, 'isql.py')
+        with open(self.stub, 'w') as f:
+            f.write(STUB_ISQL)
+        self.log = os.path.join(self.tmp_dir.name, 'isql.log')
+
+    def isql(self, status=0):
+        return ' '.join(shlex.quote(arg) for arg in [
+            sys.executable, self.stub, self.log, str(status)])
+
+    def sessions(self):
+        with open(self.log) as f:
+            return f.read().split('-- end of session\n')[:-1]
+
+    def test_load(self):
+        self.assertTrue(
+            insert_single_ttl.load(self.isql(), ['de', 'en'], loaders=3))
+        sessions = self.sessions()
+        # setup, three concurrent loaders and the final checkpoint
+        self.assertEqual(len(sessions), 5)
+        self.assertIn("'de_*.ttl.gz'", sessions[0])
+        self.assertIn("'eng_*.ttl.gz'", sessions[0])
+        self.assertEqual(
+            sum('rdf_loader_run()' in s for s in sessions[1:4]), 3)
+        self.assertIn('checkpoint', sessions[4])
+
+    def test_isql_failure(self):
+        self.assertFalse(
+            insert_single_ttl.load(self.isql(status=1), ['de'], loaders=2))
+        # nothing is loaded after the setup failed
+        self.assertEqual(len(self.sessions()), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
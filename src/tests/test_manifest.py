@@ -0,0 +1,74 @@
+import os
+import sqlite3
+import unittest
+import tempfile
+
+import manifest
+
+
+class TestManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.orig_manifest = manifest.MANIFEST
+        manifest.MANIFEST = self.path('manifest.sqlite3')
+        self.conn = manifest.connect()
+        self.input = self.path('input.sqlite3')
+        self.output = self.path('output.sqlite3')
+        self.write(self.input, ['a', 'b'])
+        self.write(self.output, ['x'])
+
+    def tearDown(self):
+        self.conn.close()
+        manifest.MANIFEST = self.orig_manifest
+        self.tmp_dir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmp_dir.name, name)
+
+    def write(self, path, values):
+        conn = sqlite3.connect(path)
+        conn.execute("DROP TABLE IF EXISTS t")
+        conn.execute("CREATE TABLE t (x)")
+        conn.executemany("INSERT INTO t VALUES (?)", [[v] for v in values])
+        conn.commit()
+        conn.close()
+
+    def key(self, config=None):
+        return manifest.stage_key(self.conn, [self.input], [__file__], config)
+
+    def test_content(self):
+        key = self.key()
+        manifest.record(self.conn, self.output, key)
+        self.assertTrue(manifest.up_to_date(self.conn, self.output, key))
+
+        # same content, new file
+        self.write(self.input, ['a', 'b'])
+        self.assertEqual(self.key(), key)
+        # different content or config
+        self.assertNotEqual(self.key(config=dict(fuzzy='deletion')), key)
+        self.write(self.input, ['a', 'c'])
+        self.assertNotEqual(self.key(), key)
+
+    def test_output_changed(self):
+        key = self.key()
+        manifest.record(self.conn, self.output, key)
+        self.write(self.output, ['x', 'y'])
+        self.assertFalse(manifest.up_to_date(self.conn, self.output, key))
+        os.remove(self.output)
+        self.assertFalse(manifest.up_to_date(self.conn, self.output, key))
+
+    def test_output_tables(self):
+        key = self.key()
+        manifest.record(self.conn, self.output, key, ['t'])
+        # other tables in the same db don't matter
+        conn = sqlite3.connect(self.output)
+        conn.execute("CREATE TABLE other (y)")
+        conn.commit()
+        conn.close()
+        self.assertTrue(
+            manifest.up_to_date(self.conn, self.output, key, ['t']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import re
+import sqlite3
+import unittest
+import tempfile
+
+import helper
+import process
+from synthetic import make_raw_dbs
+
+scan_re = re.compile(r'^SCAN (\S+)$')
+subquery_re = re.compile(r'^(?:CO-ROUTINE|MATERIALIZE) (\S+)$')
+
+
+class TestQueryPlans(unittest.TestCase):
+    """ The process stage must use the indexes of the raw dbs
+
+    Full scans are only allowed for the tables listed per target, and SQLite
+    must not have to build automatic indexes.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        make_raw_dbs(cls.path('raw'), ['de', 'en'], vocab_size=50)
+        cls.plans = {}
+        for lang, attach, targets in [
+            ('de', {}, [process.make_entry, process.make_form,
+                        process.make_importance]),
+            ('en', {}, [process.make_entry, process.make_importance]),
+            ('de-en', {'lang': 'de', 'other_lang': 'en'},
+             [process.make_translation]),
+        ]:
+            conn = sqlite3.connect(cls.path(lang + '.sqlite3'))
+            helper.attach_db(conn, cls.path('raw', lang + '.sqlite3'), 'raw')
+            for name, attached_lang in attach.items():
+                helper.attach_db(
+                    conn, cls.path(attached_lang + '.sqlite3'), name)
+            for f in targets:
+                collector = helper.PlanCollector(conn)
+                helper.trace(conn, collector)
+                f(conn, lang)
+                helper.trace(conn)
+                cls.plans[lang, f.__name__] = collector.plans
+            conn.commit()
+            conn.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    @classmethod
+    def path(cls, *parts):
+        return os.path.join(cls.tmp_dir.name, *parts)
+
+    def assertIndexed(self, lang, target, allowed_scans=()):
+        plans = self.plans[lang, target]
+        self.assertTrue(plans)
+        for plan in plans:
+            # scanning the result of a subquery or view is fine
+            subqueries = {m.group(1) for m in map(subquery_re.match,
+                                                  plan['plan']) if m}
+            for line in plan['plan']:
+                self.assertNotIn('AUTOMATIC', line, plan)
+                self.assertFalse(line.startswith('error'), plan)
+                scan = scan_re.match(line)
+                if scan and scan.group(1) not in subqueries:
+                    self.assertIn(scan.group(1), allowed_scans, plan)
+
+    def test_entry(self):
+        self.assertIndexed('de', 'make_entry')
+
+    def test_form(self):
+        self.assertIndexed('de', 'make_form', ['raw.form'])
+
+    def test_importance(self):
+        self.assertIndexed('de', 'make_importance')
+
+    def test_translation(self):
+        self.assertIndexed('de-en', 'make_translation', ['raw.translation'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import io
+import json
+import sqlite3
+import unittest
+
+import progress
+
+
+class TestProgress(unittest.TestCase):
+
+    def setUp(self):
+        self.orig = progress.mode, progress.INTERVAL, progress.VM_STEPS
+        progress.mode = 'json'
+        progress.INTERVAL = 0
+        progress.VM_STEPS = 100
+
+    def tearDown(self):
+        progress.mode, progress.INTERVAL, progress.VM_STEPS = self.orig
+
+    def events(self, out):
+        return [json.loads(line) for line in out.getvalue().splitlines()]
+
+    def test_eta(self):
+        out = io.StringIO()
+        reporter = progress.Reporter('fetch', expected=1000, field='rows',
+                                     out=out)
+        reporter.update(rows=250)
+        reporter.finish(rows=1000)
+        first, last = self.events(out)
+        self.assertEqual(first['rows'], 250)
+        # three times as long as it took so far
+        self.assertAlmostEqual(first['eta'], 3 * first['elapsed'], places=2)
+        self.assertEqual(last['eta'], 0)
+        self.assertTrue(last['done'])
+
+    def test_disabled(self):
+        progress.mode = None
+        out = io.StringIO()
+        progress.Reporter('fetch', out=out).update(rows=1)
+        self.assertEqual(out.getvalue(), '')
+
+    def test_statement_progress(self):
+        out = io.StringIO()
+        conn = sqlite3.connect(':memory:')
+        sql_progress = progress.watch(conn, 'count')
+        sql_progress.reporter.out = out
+        conn.set_trace_callback(sql_progress)
+        conn.execute("""
+            WITH RECURSIVE numbers(x) AS (
+                SELECT 1 UNION ALL SELECT x + 1 FROM numbers WHERE x < 1000
+            )
+            SELECT count(*) FROM numbers
+        """).fetchone()
+        sql_progress.finish()
+        events = self.events(out)
+        self.assertGreater(len(events), 2)
+        self.assertEqual(events[0]['statement'], 1)
+        self.assertGreater(events[-2]['steps'], events[0]['steps'])
+        self.assertIn('WITH RECURSIVE', events[0]['sql'])
+        self.assertEqual(events[-1], dict(events[-1], done=True,
+                                          statements=1))
+
+
+if __name__ == '__main__':
+    unittest.main()
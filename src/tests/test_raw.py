@@ -0,0 +1,272 @@
+import os
+import sqlite3
+import unittest
+import tempfile
+from urllib.parse import urlsplit, parse_qs
+
+from sparql import queries
+from sparql import run as sparql_run
+from sparql.queries import add_lexentry_ids, check_lexentry_ids
+
+SRC_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestLexentryIds(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        self.conn.executescript("""
+            CREATE TABLE entry ("lexentry" text, "vocable" text);
+            INSERT INTO entry VALUES ('deu/Maus__noun__1', 'deu/Maus'),
+                                     ('deu/Haus__noun__1', 'deu/Haus');
+            CREATE TABLE pos ("lexentry" text, "part_of_speech" text);
+            INSERT INTO pos VALUES ('deu/Haus__noun__1', 'noun');
+        """)
+
+    def uris(self, table):
+        return self.conn.execute("""
+            SELECT uri FROM {} LEFT JOIN lexentry ON (id = lexentry)
+            ORDER BY {}.rowid
+        """.format(table, table)).fetchall()
+
+    def test_convert(self):
+        add_lexentry_ids(self.conn)
+        self.assertEqual(
+            self.conn.execute("SELECT * FROM lexentry").fetchall(),
+            [(1, 'deu/Haus__noun__1'), (2, 'deu/Maus__noun__1')])
+        self.assertEqual(
+            self.conn.execute("SELECT * FROM entry").fetchall(),
+            [(2, 'deu/Maus'), (1, 'deu/Haus')])
+        self.assertEqual(self.uris('pos'), [('deu/Haus__noun__1',)])
+
+    def test_refetch(self):
+        add_lexentry_ids(self.conn)
+        # a single table fetched again, containing a new lexentry
+        self.conn.executescript("""
+            DROP TABLE pos;
+            CREATE TABLE pos ("lexentry" text, "part_of_speech" text);
+            INSERT INTO pos VALUES ('deu/Haus__noun__1', 'noun'),
+                                   ('deu/Baum__noun__1', 'noun');
+        """)
+        add_lexentry_ids(self.conn)
+        self.assertEqual(
+            self.uris('pos'), [('deu/Haus__noun__1',), ('deu/Baum__noun__1',)])
+        self.assertEqual(
+            self.uris('entry'), [('deu/Maus__noun__1',), ('deu/Haus__noun__1',)])
+
+    def test_incomplete_fetch(self):
+        queries.write_checkpoint(self.conn, 'pos', 'key', 1000, 1, False)
+        add_lexentry_ids(self.conn)
+        # resuming the fetch appends URIs, so pos must keep them
+        self.assertEqual(self.conn.execute("SELECT lexentry FROM pos")
+                         .fetchall(), [('deu/Haus__noun__1',)])
+        with self.assertRaisesRegex(Exception, 'no lexentry ids in pos'):
+            check_lexentry_ids(self.conn, 'de.sqlite3')
+
+        queries.write_checkpoint(self.conn, 'pos', 'key', 2000, 1, True)
+        add_lexentry_ids(self.conn)
+        check_lexentry_ids(self.conn, 'de.sqlite3')
+
+    def test_check_unconverted(self):
+        with self.assertRaisesRegex(Exception, 'no lexentry ids in entry'):
+            check_lexentry_ids(self.conn, 'de.sqlite3')
+
+
+class TestConvertIds(unittest.TestCase):
+
+    def setUp(self):
+        cwd = os.getcwd()
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.addCleanup(os.chdir, cwd)
+        os.chdir(tmp_dir.name)
+        os.makedirs('dictionaries/raw')
+
+    def test_convert_old_db(self):
+        # fetched before the checkpoints and lexentry ids existed
+        conn = sqlite3.connect('dictionaries/raw/de.sqlite3')
+        conn.executescript("""
+            CREATE TABLE entry ("lexentry" text, "vocable" text);
+            INSERT INTO entry VALUES ('deu/Haus__noun__1', 'deu/Haus');
+            CREATE TABLE pos ("lexentry" text, "part_of_speech" text);
+            CREATE TABLE gender ("lexentry" text, "gender" text);
+            CREATE TABLE pronun ("lexentry" text, "pronun" text);
+            CREATE TABLE form ("lexentry" text, "other_written" text);
+            CREATE TABLE importance ("vocable" text, "score" float);
+        """)
+        conn.close()
+        sparql_run.do('de', only=None, resume=False, http_timeout=1,
+                      retries=0, convert_ids=True)
+        conn = sqlite3.connect('dictionaries/raw/de.sqlite3')
+        check_lexentry_ids(conn, 'de.sqlite3')
+        self.assertEqual(conn.execute("""
+            SELECT uri, vocable FROM entry JOIN lexentry ON (id = lexentry)
+        """).fetchall(), [('deu/Haus__noun__1', 'deu/Haus')])
+        conn.close()
+
+
+def uri(value):
+    return {'type': 'uri', 'value': value}
+
+
+def literal(value):
+    return {'type': 'literal', 'value': value}
+
+
+class TestSplitQuery(unittest.TestCase):
+
+    def setUp(self):
+        cwd = os.getcwd()
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.addCleanup(os.chdir, cwd)
+        os.chdir(tmp_dir.name)
+        os.symlink(SRC_PATH, 'src')
+
+        def fake_pages(query, limit, reporter=None, **kwargs):
+            queries.cols = ['lexentry', 'sense_num', 'sense',
+                            'trans_entity', 'trans', 'target_language']
+            lexvo = 'http://lexvo.org/id/iso639-3/'
+            entry = uri('http://kaiko.getalp.org/dbnary/deu/Haus__noun__1')
+            yield [
+                {'target_language': uri(lexvo + 'eng'), 'lexentry': entry,
+                 'sense_num': literal('1'), 'trans': literal('house')},
+                {'target_language': uri(lexvo + 'fra'), 'lexentry': entry,
+                 'sense_num': literal('1'), 'trans': literal('maison')},
+            ]
+            yield [
+                {'target_language': uri(lexvo + 'eng'), 'lexentry': entry,
+                 'sense_num': literal('2'), 'trans': literal('home')},
+            ]
+
+        page_through_results = queries.page_through_results
+        self.addCleanup(setattr, queries, 'page_through_results',
+                        page_through_results)
+        queries.page_through_results = fake_pages
+
+    def rows(self, pair):
+        conn = sqlite3.connect('dictionaries/raw/%s.sqlite3' % pair)
+        try:
+            return conn.execute(
+                "SELECT lexentry, sense_num, trans FROM translation"
+            ).fetchall()
+        finally:
+            conn.close()
+
+    def test_split(self):
+        query = queries.all_targets_translation_query(
+            'sense', ['en', 'fr', 'sv'])
+        self.assertIn(
+            '?target_language IN (lexvo:eng, lexvo:fra, lexvo:swe)', query)
+        self.assertNotIn('to_lang3', query)
+        self.assertRegex(query, r'SELECT \?lexentry\s')
+        self.assertRegex(query, r'\?target_language\s+WHERE')
+        # a total order for paging, instead of make_url's ORDER BY 1
+        self.assertRegex(query, r'\}\s*ORDER BY 1 6 4 2 3 5\s*$')
+        url = queries.make_url(query, offset=0, limit=10, from_lang='de',
+                               lang='de')
+        self.assertEqual(
+            parse_qs(urlsplit(url).query)['query'][0].count('ORDER BY'), 1)
+        queries.get_split_query('translation', query, 'de', ['en', 'fr', 'sv'])
+        self.assertEqual(self.rows('de-en'), [
+            ('deu/Haus__noun__1', '1', 'house'),
+            ('deu/Haus__noun__1', '2', 'home'),
+        ])
+        self.assertEqual(self.rows('de-fr'),
+                         [('deu/Haus__noun__1', '1', 'maison')])
+        # targets without translations get an empty table
+        self.assertEqual(self.rows('de-sv'), [])
+
+
+
+class TestResume(unittest.TestCase):
+
+    def setUp(self):
+        cwd = os.getcwd()
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.addCleanup(os.chdir, cwd)
+        os.chdir(tmp_dir.name)
+        # get_query saves the table definition here
+        os.makedirs('src/sql/sparql')
+
+        self.addCleanup(setattr, queries, 'PAGE_SIZE', queries.PAGE_SIZE)
+        queries.PAGE_SIZE = 2
+        self.results = [
+            {'vocable': uri('http://kaiko.getalp.org/dbnary/deu/%s' % word),
+             'score': {'type': 'typed-literal', 'value': str(score),
+                       'datatype': 'http://www.w3.org/2001/XMLSchema#double'}}
+            for score, word in enumerate(
+                ['Haus', 'Maus', 'Baum', 'Raum', 'Zaun'])
+        ]
+        self.fail_at = None
+        self.offsets = []
+
+        def fake_pages(query, limit, reporter=None, offset=0, **kwargs):
+            queries.cols = ['vocable', 'score']
+            while True:
+                if offset == self.fail_at:
+                    raise ConnectionError('fetch aborted')
+                self.offsets.append(offset)
+                page = self.results[offset:offset + limit]
+                yield page
+                if len(page) < limit:
+                    break
+                offset += limit
+
+        page_through_results = queries.page_through_results
+        self.addCleanup(setattr, queries, 'page_through_results',
+                        page_through_results)
+        queries.page_through_results = fake_pages
+
+    def fetch(self, resume):
+        queries.get_query('importance', queries.importance_query,
+                          resume=resume, lang='de')
+
+    def rows(self):
+        conn = sqlite3.connect('dictionaries/raw/de.sqlite3')
+        try:
+            return conn.execute("SELECT * FROM importance").fetchall()
+        finally:
+            conn.close()
+
+    def test_resume(self):
+        self.fail_at = 4
+        with self.assertRaises(ConnectionError):
+            self.fetch(resume=False)
+        self.assertEqual(len(self.rows()), 4)
+
+        self.fail_at = None
+        self.offsets = []
+        self.fetch(resume=True)
+        self.assertEqual(self.offsets, [4])
+        self.assertEqual([vocable for vocable, _ in self.rows()],
+                         ['deu/Haus', 'deu/Maus', 'deu/Baum', 'deu/Raum',
+                          'deu/Zaun'])
+
+        # complete fetches are skipped
+        self.offsets = []
+        self.fetch(resume=True)
+        self.assertEqual(self.offsets, [])
+        self.assertEqual(len(self.rows()), 5)
+
+    def test_without_resume(self):
+        self.fail_at = 2
+        with self.assertRaises(ConnectionError):
+            self.fetch(resume=False)
+        self.fail_at = None
+        self.offsets = []
+        self.fetch(resume=False)
+        self.assertEqual(self.offsets, [0, 2, 4])
+        self.assertEqual(len(self.rows()), 5)
+
+    def test_changed_query(self):
+        self.fetch(resume=False)
+        self.offsets = []
+        queries.get_query('importance', queries.importance_query + ' ',
+                          resume=True, lang='de')
+        self.assertEqual(self.offsets, [0, 2, 4])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import os
+import sqlite3
+import unittest
+import tempfile
+import threading
+
+from sparql import queries
+from sparql.replay_server import make_server, synthetic_results, ResultSet
+
+WORDS = ['Haus', 'say "hi"', 'back\\slash', 'emoji \U0001F600', 'Straße',
+         '日本', 'new\nline']
+
+
+class TestReplayServer(unittest.TestCase):
+    """ Fetch from the stand-in server through the real fetch path """
+
+    def setUp(self):
+        cwd = os.getcwd()
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.addCleanup(os.chdir, cwd)
+        os.chdir(tmp_dir.name)
+        # get_query saves the table definition here
+        os.makedirs('src/sql/sparql')
+
+        self.server = make_server(ResultSet(
+            ['lexentry', 'sense_num', 'trans'],
+            [{'lexentry': {'type': 'uri', 'value':
+                           'http://kaiko.getalp.org/dbnary/deu/w%s' % i},
+              'sense_num': {'type': 'typed-literal', 'value': str(i),
+                            'datatype':
+                                'http://www.w3.org/2001/XMLSchema#integer'},
+              'trans': {'type': 'literal', 'xml:lang': 'en',
+                        'value': WORDS[i % len(WORDS)]}}
+             for i in range(25)]))
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        for name, value in [
+            ('SERVER', 'http://127.0.0.1:%s' % self.server.server_port),
+            ('PAGE_SIZE', 10),
+            ('transport', queries.Transport(timeout=5, retries=0)),
+        ]:
+            self.addCleanup(setattr, queries, name, getattr(queries, name))
+            setattr(queries, name, value)
+        self.addCleanup(queries.transport.close)
+
+    def fetch(self):
+        queries.get_query('translation', queries.translation_query['sense'],
+                          from_lang='de', to_lang='en')
+        conn = sqlite3.connect('dictionaries/raw/de-en.sqlite3')
+        try:
+            return conn.execute("""
+                SELECT lexentry, sense_num, trans FROM translation
+            """).fetchall()
+        finally:
+            conn.close()
+
+    def test_round_trip(self):
+        self.assertEqual(self.fetch(), [
+            ('deu/w%s' % i, i, WORDS[i % len(WORDS)]) for i in range(25)])
+
+    def test_synthetic(self):
+        self.server.results = synthetic_results(25)
+        self.assertEqual(len(self.fetch()), 25)
+
+    def test_gzip(self):
+        self.server.gzip = True
+        self.assertEqual(len(self.fetch()), 25)
+
+
+if __name__ == '__main__':
+    unittest.main()
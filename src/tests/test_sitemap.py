@@ -0,0 +1,41 @@
+import os
+import unittest
+import tempfile
+
+from sitemap import SitemapWriter, url_tmpl
+
+
+class TestSitemapWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.orig_dir = os.getcwd()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp_dir.name)
+        os.mkdir('sitemap')
+
+    def tearDown(self):
+        os.chdir(self.orig_dir)
+        self.tmp_dir.cleanup()
+
+    def test_split(self):
+        writer = SitemapWriter('de-en-de', max_urls=2)
+        for vocable in ['Haus', 'Baum', 'Kuh']:
+            writer.write(url_tmpl.format('de-en', vocable))
+        self.assertEqual(writer.close(),
+                         ['sitemap/de-en-de.xml', 'sitemap/de-en-de-2.xml'])
+        with open('sitemap/de-en-de-2.xml') as f:
+            content = f.read()
+        self.assertTrue(content.endswith('</urlset>'))
+        self.assertEqual(content.count('<url>'), 1)
+
+    def test_max_bytes(self):
+        url = url_tmpl.format('de-en', 'Haus')
+        writer = SitemapWriter('de-en-de', max_bytes=500)
+        for i in range(10):
+            writer.write(url)
+        for filename in writer.close():
+            self.assertLessEqual(os.path.getsize(filename), 500)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+import os
+import unittest
+import sqlite3
+import tempfile
+
+from synthetic import make_raw_dbs
+
+
+class TestSynthetic(unittest.TestCase):
+
+    def test_raw_dbs(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            make_raw_dbs(tmp_dir, ['de', 'fr'], vocab_size=100, density=1)
+            self.assertEqual(
+                sorted(os.listdir(tmp_dir)),
+                ['de-fr.sqlite3', 'de.sqlite3', 'fr-de.sqlite3', 'fr.sqlite3'])
+
+            conn = sqlite3.connect(os.path.join(tmp_dir, 'de.sqlite3'))
+            self.assertEqual(
+                conn.execute("SELECT count(*) FROM entry").fetchone(), (100,))
+            # every entry has an importance
+            self.assertEqual(conn.execute("""
+                SELECT count(*) FROM entry JOIN importance USING (vocable)
+            """).fetchone(), (100,))
+
+            conn = sqlite3.connect(os.path.join(tmp_dir, 'de-fr.sqlite3'))
+            columns = [c[1] for c in conn.execute(
+                "PRAGMA table_info(translation)")]
+            self.assertEqual(
+                columns, ['lexentry', 'sense_num', 'sense', 'trans_entity',
+                          'trans'])
+            self.assertGreaterEqual(
+                conn.execute("SELECT count(DISTINCT lexentry) FROM translation")
+                .fetchone()[0], 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+# vim: set fileencoding=utf-8 :
+import os
+import gzip
+import unittest
+import tempfile
+
+import tei
+from tei import tei_entry_text, tei_entry_text_etree
+
+
+class TestTeiSerialization(unittest.TestCase):
+
+    entries = [
+        dict(written_rep='Haus', part_of_speech='noun', gender='neuter',
+             pronuns=['haʊ̯s'], senses=[
+                 dict(gloss='Gebäude', trans_list=['house', 'building']),
+                 dict(gloss='Familie & <Dynastie>',
+                      trans_list=['house', 'building']),
+                 dict(gloss=None, trans_list=['home']),
+             ]),
+        dict(written_rep='-heit', part_of_speech=None, gender=None,
+             pronuns=[], senses=[dict(gloss=None, trans_list=['-hood'])]),
+        dict(written_rep='-', part_of_speech='suffix', gender=None,
+             pronuns=[''], senses=[dict(gloss='', trans_list=[])]),
+        dict(written_rep='gehen', part_of_speech='', gender=None,
+             pronuns=[], senses=[dict(gloss='"laufen"', trans_list=['go'])]),
+    ]
+
+    def test_same_as_etree(self):
+        for x in self.entries:
+            self.assertEqual(tei_entry_text(x, 'en'),
+                             tei_entry_text_etree(x, 'en'))
+
+
+class TestWriteTeiDict(unittest.TestCase):
+
+    def setUp(self):
+        cwd = os.getcwd()
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.addCleanup(os.chdir, cwd)
+        os.chdir(tmp_dir.name)
+        os.makedirs('dictionaries/tei/small')
+        for name, value in [
+            ('count_headwords', lambda from_lang, to_lang: 2),
+            ('get_translations', lambda from_lang, to_lang: iter(
+                TestTeiSerialization.entries[:self.entries])),
+        ]:
+            self.addCleanup(setattr, tei, name, getattr(tei, name))
+            setattr(tei, name, value)
+
+    def test_write(self):
+        self.entries = 2
+        path = tei.write_tei_dict('de', 'en', 'gz')
+        self.assertEqual(os.listdir('dictionaries/tei/small'),
+                         ['deu-eng.tei.gz'])
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            self.assertEqual(f.read().count('<entry>'), 2)
+
+    def test_count_mismatch(self):
+        # e.g. the db changed between counting and writing
+        self.entries = 1
+        with self.assertRaises(AssertionError):
+            tei.write_tei_dict('de', 'en', 'gz')
+        # neither the inconsistent file nor its temporary copy are left
+        self.assertEqual(os.listdir('dictionaries/tei/small'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import gzip
+import zlib
+import threading
+import unittest
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+from sparql.transport import Transport, HTTPError
+
+BODY = b'{"head": {"vars": []}, "results": {"bindings": []}}' * 100
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append((self.client_address, self.path,
+                                self.headers.get('Accept-Encoding')))
+        if server.failures:
+            status = server.failures.pop(0)
+            body = b'Virtuoso S1T00 Error'
+        else:
+            status = 200
+            body = BODY
+        encoding = self.path.strip('/')
+        if status == 200 and encoding == 'gzip':
+            body = gzip.compress(body)
+        elif status == 200 and encoding == 'deflate':
+            body = zlib.compress(body)
+        elif status == 200 and encoding == 'raw-deflate':
+            compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+            body = compressor.compress(body) + compressor.flush()
+            encoding = 'deflate'
+        self.send_response(status)
+        if status == 200 and encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestTransport(unittest.TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), StubHandler)
+        self.server.requests = []
+        self.server.failures = []
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.transport = Transport(timeout=5, retries=2, backoff=0)
+        self.addCleanup(self.transport.close)
+
+    def url(self, path=''):
+        return 'http://127.0.0.1:%s/%s' % (self.server.server_port, path)
+
+    def test_keep_alive(self):
+        for _ in range(3):
+            self.assertEqual(self.transport.fetch(self.url()), BODY)
+        clients = {client for client, _, _ in self.server.requests}
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(len(clients), 1)
+
+    def test_compression(self):
+        for encoding in ['gzip', 'deflate', 'raw-deflate']:
+            self.assertEqual(
+                self.transport.fetch(self.url(encoding),
+                                     lambda r: b''.join(iter(
+                                         lambda: r.read(100), b''))),
+                BODY)
+        self.assertEqual(self.server.requests[0][2], 'gzip, deflate')
+
+    def test_retry(self):
+        self.server.failures = [503, 500]
+        self.assertEqual(self.transport.fetch(self.url()), BODY)
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_give_up(self):
+        self.server.failures = [503, 503, 503]
+        with self.assertRaises(HTTPError) as cm:
+            self.transport.fetch(self.url())
+        self.assertEqual(cm.exception.status, 503)
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_no_retry_on_client_error(self):
+        self.server.failures = [400]
+        with self.assertRaises(HTTPError) as cm:
+            self.transport.fetch(self.url())
+        self.assertEqual(cm.exception.body, b'Virtuoso S1T00 Error')
+        self.assertEqual(len(self.server.requests), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
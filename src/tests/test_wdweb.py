@@ -0,0 +1,194 @@
+# vim: set fileencoding=utf-8 :
+import os
+import json
+import unittest
+import sqlite3
+import tempfile
+
+import helper
+import wdweb
+
+try:
+    import pysqlite3  # noqa: F401, used by helper.connect
+except ImportError:
+    pysqlite3 = None
+
+
+class TestSearchIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.lang_db = os.path.join(self.tmp_dir.name, 'de.sqlite3')
+        self.conn = sqlite3.connect(':memory:')
+        self.conn.executescript("""
+            CREATE TABLE translation (
+                lexentry text, written_rep text, sense_list text,
+                trans_list text, min_sense_num text, written_key text,
+                written_length int, rank real
+            );
+            INSERT INTO translation VALUES
+                ('Haus', 'Haus', NULL, 'house', '01', 'haus', 4, 1),
+                ('Hausboot', 'Hausboot', NULL, 'houseboat', '01',
+                 'hausboot', 8, 1),
+                ('Baum', 'Baum', NULL, 'tree', '01', 'baum', 4, 1),
+                ('Guten Tag', 'Guten Tag', NULL, 'good day', '01',
+                 'guten tag', 9, 1),
+                ('Tageslicht', 'Tageslicht', NULL, 'daylight', '01',
+                 'tageslicht', 10, 1);
+        """)
+
+    def tearDown(self):
+        self.conn.close()
+        self.tmp_dir.cleanup()
+
+    def build(self, index_type, detail='full'):
+        lang_conn = sqlite3.connect(self.lang_db)
+        lang_conn.executescript("""
+            ATTACH DATABASE ':memory:' AS processed;
+            CREATE TABLE processed.form (lexentry text, other_written text);
+            INSERT INTO processed.form VALUES
+                ('Haus', 'Häuser'), ('Baum', 'Bäume'), ('Kuh', 'Kühe');
+            DROP TABLE IF EXISTS entry;
+            CREATE TABLE entry (lexentry text, written_rep text);
+            INSERT INTO entry VALUES
+                ('Haus', 'Haus'), ('Baum', 'Baum'), ('Kuh', 'Kuh');
+        """)
+        wdweb.make_form_search_index(lang_conn, 'de', index_type, detail)
+        lang_conn.commit()
+        lang_conn.close()
+        wdweb.make_search_index(self.conn, 'de-en', index_type, detail)
+        self.conn.commit()
+        self.conn.execute("ATTACH DATABASE ? AS lang", [self.lang_db])
+
+    def search(self, term):
+        query = """
+            SELECT written_rep
+            FROM ({})
+                JOIN translation USING (written_rep)
+            ORDER BY written_rep
+        """.format(wdweb.search_candidates_query(self.conn))
+        return [w for (w,) in self.conn.execute(
+            query, wdweb.search_params(term))]
+
+    def check_search(self):
+        self.assertEqual(self.search('haus*'), ['Haus', 'Hausboot'])
+        self.assertEqual(self.search('Häuser'), ['Haus'])
+        self.assertEqual(self.search('bäume'), ['Baum'])
+        # only in the language db, not in this pair
+        self.assertEqual(self.search('Kühe'), [])
+        self.conn.execute("DETACH DATABASE lang")
+
+    def test_fts4(self):
+        self.build('fts4')
+        self.check_search()
+
+    def test_fts5(self):
+        for detail in ['full', 'none']:
+            self.build('fts5', detail)
+            self.check_search()
+
+    def test_multi_word(self):
+        for index_type, detail in [('fts4', 'full'), ('fts5', 'full'),
+                                   ('fts5', 'column'), ('fts5', 'none')]:
+            self.build(index_type, detail)
+            for term in ['guten tag', 'tag guten', 'guten ta*']:
+                self.assertEqual(self.search(term), ['Guten Tag'],
+                                 (index_type, detail, term))
+            self.assertEqual(self.search('guten baum'), [])
+            self.conn.execute("DETACH DATABASE lang")
+
+    def test_search(self):
+        self.build('fts4')
+        # exact match on folded key
+        self.assertEqual(
+            [r[1] for r in wdweb.search(self.conn, 'HAUS')], ['Haus'])
+        # full text search
+        self.assertEqual(
+            [r[1] for r in wdweb.search(self.conn, 'haus*')],
+            ['Haus', 'Hausboot'])
+        self.assertEqual(
+            [r[1] for r in wdweb.search(self.conn, 'Bäume')], ['Baum'])
+        # headwords starting with the term before shorter ones
+        self.assertEqual(
+            [r[1] for r in wdweb.search(self.conn, 'TAG*')],
+            ['Tageslicht', 'Guten Tag'])
+
+
+def make_fts5_form_search_index(conn, lang):
+    wdweb.make_form_search_index(conn, lang, 'fts5', 'none')
+
+
+@unittest.skipUnless(pysqlite3, 'make_targets needs pysqlite3')
+class TestMakeTargets(unittest.TestCase):
+    """ Build the search indexes the way `run.py wdweb` does """
+
+    def setUp(self):
+        cwd = os.getcwd()
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.addCleanup(os.chdir, cwd)
+        os.chdir(tmp_dir.name)
+        os.makedirs('dictionaries/processed')
+        os.makedirs('dictionaries/wdweb')
+        conn = sqlite3.connect('dictionaries/processed/de.sqlite3')
+        conn.executescript("""
+            CREATE TABLE form (lexentry text, other_written text);
+            INSERT INTO form VALUES ('Haus', 'Häuser');
+        """)
+        conn.close()
+        conn = sqlite3.connect('dictionaries/wdweb/de.sqlite3')
+        conn.executescript("""
+            CREATE TABLE entry (lexentry text, written_rep text);
+            INSERT INTO entry VALUES ('Haus', 'Haus'), ('Baum', 'Baum');
+        """)
+        conn.close()
+
+        def close_connections():
+            while helper.connections:
+                helper.connections.popitem()[1].close()
+        self.addCleanup(close_connections)
+
+    def test_fts5(self):
+        helper.make_targets(
+            'de', in_path='processed', out_path='wdweb',
+            targets=[('form_search_index', make_fts5_form_search_index)])
+        with open(helper.BUILD_LOG) as f:
+            record = json.loads(f.readline())
+        # the contentless index itself can not be counted
+        self.assertEqual(record['rows'], {'search_form_rep': 3})
+
+    def test_in_path_not_staged(self):
+        self.addCleanup(setattr, helper, 'memory_staging_limit', 0)
+        self.addCleanup(helper.staged_dbs.clear)
+        helper.memory_staging_limit = 100
+        conn = sqlite3.connect('dictionaries/processed/en.sqlite3')
+        conn.execute('CREATE TABLE entry (lexentry text)')
+        conn.close()
+        helper.make_targets(
+            'de', in_path='processed', out_path='wdweb',
+            targets=[('form_search_index', make_fts5_form_search_index)],
+            attach=["'dictionaries/processed/en.sqlite3' AS other"])
+        # processed/de is only read for wdweb/de
+        self.assertEqual(list(helper.staged_dbs),
+                         ['dictionaries/processed/en.sqlite3'])
+
+    def test_without_manifest(self):
+        def build(target=make_fts5_form_search_index, **kwargs):
+            helper.make_targets(
+                'de', in_path='processed', out_path='wdweb',
+                targets=[('form_search_index', target)], **kwargs)
+            with open(helper.BUILD_LOG) as f:
+                return len(f.readlines())
+
+        def bench(conn, lang):
+            conn.execute('SELECT count(*) FROM search_form_rep').fetchall()
+
+        self.assertEqual(build(), 1)
+        # like wdweb-bench, runs each time and keeps the build's entry
+        self.assertEqual(build(bench, check_manifest=False), 2)
+        self.assertEqual(build(bench, check_manifest=False), 3)
+        self.assertEqual(build(), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
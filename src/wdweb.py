@@ -1,6 +1,7 @@
 from collections import defaultdict
 
-from helper import make_targets
+from helper import make_targets, create_function
+from fuzzy import make_fuzzy_index, fold
 
 
 TOKENIZER = defaultdict(lambda: 'unicode61', {
@@ -27,7 +28,6 @@ def make_vocable(conn, lang):
 
 
 def make_entry(conn, lang):
-    conn.load_extension('lib/spellfix1')
     conn.executescript("""
         DROP TABLE IF EXISTS main.entry;
         CREATE TABLE main.entry AS
@@ -37,8 +37,12 @@ def make_entry(conn, lang):
         WHERE written_rep IS NOT NULL;
 
         CREATE INDEX main.entry_written_rep_idx ON entry(written_rep);
+    """)
 
-        -- spellfix
+
+def make_spellfix(conn, lang):
+    conn.load_extension('lib/spellfix1')
+    conn.executescript("""
         --DROP TABLE IF EXISTS main.search_trans_aux;
         --CREATE VIRTUAL TABLE main.search_trans_aux USING fts4aux(search_trans);
         DROP TABLE IF EXISTS main.spellfix_entry;
@@ -94,66 +98,339 @@ def make_display(conn, lang):
 
 def make_translation(conn, lang_pair):
     apply_views(conn)
+    create_function(conn, 'fold', 1, fold)
+    # The table is clustered by written_rep, so that all rows for a headword
+    # are stored together. `seq` keeps the rows in lexentry and sense order.
+    # written_key, written_length and rank are precomputed for `search`.
     conn.executescript("""
         DROP TABLE IF EXISTS main.translation;
-        CREATE TABLE main.translation AS
+        CREATE TABLE main.translation (
+            lexentry text,
+            written_rep text NOT NULL,
+            part_of_speech text,
+            sense_list text,
+            min_sense_num text,
+            trans_list text,
+            translation_score real,
+            importance real,
+            written_key text,
+            written_length int,
+            rank real,
+            seq int NOT NULL,
+            PRIMARY KEY (written_rep, seq)
+        ) WITHOUT ROWID;
+        INSERT INTO main.translation
         SELECT lexentry, written_rep, part_of_speech, sense_list,
                min_sense_num, trans_list,
                translation_grouped.score AS translation_score,
-               importance
+               importance,
+               fold(written_rep) AS written_key,
+               length(written_rep) AS written_length,
+               importance * translation_grouped.score AS rank,
+               row_number() OVER (
+                   PARTITION BY written_rep
+                   ORDER BY lexentry, min_sense_num
+               ) AS seq
         FROM translation_grouped 
             LEFT JOIN (
                 SELECT lexentry, part_of_speech
                 FROM entry
             ) USING (lexentry)
-        ORDER BY lexentry, min_sense_num;
+        ORDER BY written_rep, seq;
         --CREATE INDEX main.translation_lexentry_idx ON translation('lexentry');
-        CREATE INDEX main.translation_written_rep_idx ON translation('written_rep');
+        CREATE INDEX main.translation_written_key_idx ON translation('written_key');
     """)
 
 
 def make_simple_translation(conn, lang_pair):
+    # Clustered by written_rep, `seq` is the position when ordering by
+    # importance and keeps the most important rows first for each headword.
     conn.executescript("""
         DROP TABLE IF EXISTS main.simple_translation;
 
-        CREATE TABLE main.simple_translation AS
-        SELECT written_rep COLLATE NOCASE,
-            trans_list, max_score, rel_importance
+        CREATE TABLE main.simple_translation (
+            written_rep text NOT NULL COLLATE NOCASE,
+            trans_list text,
+            max_score real,
+            rel_importance real,
+            seq int NOT NULL,
+            PRIMARY KEY (written_rep, seq)
+        ) WITHOUT ROWID;
+        INSERT INTO main.simple_translation
+        SELECT written_rep, trans_list, max_score, rel_importance,
+            row_number() OVER (
+                ORDER BY max_score * rel_importance DESC
+            ) AS seq
         FROM generic.simple_translation
-        ORDER BY max_score * rel_importance DESC;
-
-        CREATE INDEX main.simple_translation_index
-            ON simple_translation('written_rep');
+        ORDER BY written_rep COLLATE NOCASE, seq;
     """)
 
 
-def make_search_index(conn, lang_pair):
-    from_lang, _ = lang_pair.split('-')
-
-    # main search index
+def analyze(conn, lang):
+    """ Ship planner statistics with the db """
+    conn.execute('ANALYZE main')
+
+
+# Query returning the distinct written_reps matching the search term, per
+# index type. FTS5 needs a quoted term, see `search_params`.
+search_candidates = {
+    'fts4': """
+        SELECT DISTINCT written_rep
+        FROM {schema}.{table}
+        WHERE form MATCH :fts4_match
+    """,
+    'fts5': """
+        SELECT DISTINCT written_rep
+        FROM {schema}.{table}
+            JOIN {schema}.{table}_rep ON ({table}_rep.id = {table}.rowid)
+        WHERE {table} MATCH :fts5_match
+    """,
+}
+
+
+def make_fts_index(conn, table, rows, tokenizer, index_type='fts4',
+                   detail='full', schema='main'):
+    """ Build a full text index mapping `form` to `written_rep`
+
+    `rows` is a query returning (form, written_rep). The FTS5 variant is
+    contentless: only the index itself is stored and the written_rep for
+    each indexed form is kept in `<table>_rep` with the same rowid. Prefix
+    indexes make the typeahead style `term*` queries cheap.
+    """
     conn.executescript("""
-        -- search table
-        DROP TABLE IF EXISTS main.search_trans;
-        CREATE VIRTUAL TABLE main.search_trans USING fts4(
-            form, written_rep, tokenize={}, notindexed=written_rep
-        );
-
-        -- insert data
-        INSERT INTO main.search_trans
-        SELECT written_rep, written_rep
-        FROM main.translation
-        UNION
-        SELECT other_written, written_rep
-        FROM form
-            JOIN entry USING (lexentry)
-        WHERE written_rep IN (
-            SELECT written_rep FROM main.translation
-        );
-    """.format(TOKENIZER[from_lang]))
+        DROP TABLE IF EXISTS {schema}.{table};
+        DROP TABLE IF EXISTS {schema}.{table}_rep;
+    """.format(schema=schema, table=table))
+    if index_type == 'fts4':
+        conn.executescript("""
+            CREATE VIRTUAL TABLE {schema}.{table} USING fts4(
+                form, written_rep, tokenize={tokenizer},
+                notindexed=written_rep
+            );
+            INSERT INTO {schema}.{table}
+            {rows};
+        """.format(schema=schema, table=table, rows=rows,
+                   tokenizer=tokenizer))
+    else:
+        conn.executescript("""
+            CREATE TABLE {schema}.{table}_rep (
+                id integer PRIMARY KEY,
+                written_rep text NOT NULL
+            );
+            CREATE VIRTUAL TABLE {schema}.{table} USING fts5(
+                form, content='', columnsize=0, prefix='2 3',
+                detail={detail}, tokenize={tokenizer}
+            );
+
+            DROP TABLE IF EXISTS temp.fts_rows;
+            CREATE TEMP TABLE fts_rows AS
+            SELECT * FROM ({rows})
+            ORDER BY 2;
+
+            INSERT INTO {schema}.{table}_rep(id, written_rep)
+            SELECT rowid, written_rep FROM temp.fts_rows;
+            INSERT INTO {schema}.{table}(rowid, form)
+            SELECT rowid, form FROM temp.fts_rows;
+            DROP TABLE temp.fts_rows;
+        """.format(schema=schema, table=table, rows=rows, detail=detail,
+                   tokenizer=tokenizer))
 
     # optimize
     conn.execute(
-        "INSERT INTO main.search_trans(search_trans) VALUES('optimize');")
+        "INSERT INTO {0}.{1}({1}) VALUES('optimize');".format(schema, table))
+
+
+def make_search_index(conn, lang_pair, index_type='fts4', detail='full',
+                      schema='main'):
+    """ Index the pair's headwords
+
+    Inflected forms are shared by all pairs of a language and indexed once in
+    the language db, see `make_form_search_index`.
+    """
+    from_lang, _ = lang_pair.split('-')
+    make_fts_index(
+        conn, 'search_trans', """
+            SELECT DISTINCT written_rep AS form, written_rep
+            FROM main.translation
+        """, TOKENIZER[from_lang], index_type, detail, schema)
+
+
+def make_form_search_index(conn, lang, index_type='fts4', detail='full'):
+    make_fts_index(
+        conn, 'search_form', """
+            SELECT other_written AS form, written_rep
+            FROM processed.form
+                JOIN main.entry USING (lexentry)
+            WHERE other_written != written_rep
+            UNION
+            SELECT written_rep, written_rep
+            FROM main.entry
+        """, TOKENIZER[lang], index_type, detail)
+
+
+def search_index_type(conn, schema='main', table='search_trans'):
+    row = conn.execute("""
+        SELECT sql FROM {}.sqlite_master WHERE name = ?
+    """.format(schema), [table]).fetchone()
+    if row is None:
+        return None
+    return 'fts5' if 'fts5' in row[0].lower() else 'fts4'
+
+
+def fts5_query(term):
+    """ Quote a search term, so that it is not parsed as FTS5 query syntax
+
+    Each whitespace separated token is quoted on its own. FTS5 then ANDs
+    them, like FTS4 does for the unquoted term, which also works with
+    `detail=column` and `detail=none`, where phrase queries are not
+    supported. A trailing `*` makes the last token a prefix query.
+    """
+    prefix = term.endswith('*')
+    tokens = term.rstrip('*').split() or ['']
+    query = ' '.join('"' + token.replace('"', '""') + '"' for token in tokens)
+    return query + '*' if prefix else query
+
+
+def search_params(term):
+    return dict(term=term, fts4_match=term, fts5_match=fts5_query(term))
+
+
+def search_candidates_query(conn, pair_schema='main', lang_schema='lang'):
+    """ Query for all written_reps matching the search term
+
+    Combines the pair's headword index with the form index of the attached
+    language db. Use `search_params` to get the query parameters.
+    """
+    parts = []
+    for schema, table in [(pair_schema, 'search_trans'),
+                          (lang_schema, 'search_form')]:
+        index_type = search_index_type(conn, schema, table)
+        if index_type:
+            parts.append(search_candidates[index_type].format(
+                schema=schema, table=table))
+    return '\nUNION\n'.join(parts)
+
+
+def search(conn, term, limit=100):
+    """ Look up translations for a search term
+
+    Exact headword hits are answered from the folded key index. Only when
+    there are none, the full text indexes are used. Their candidates are
+    ranked by whether the folded key starts with the term. That is a range
+    comparison on `written_key`, so no function is called for each row.
+    """
+    key = fold(term)
+    rows = conn.execute("""
+        SELECT lexentry, written_rep, sense_list, trans_list
+        FROM translation
+        WHERE written_key = :key
+        ORDER BY lexentry, coalesce(min_sense_num, '99'), rank DESC
+        LIMIT :limit
+    """, dict(key=key, limit=limit)).fetchall()
+    if rows:
+        return rows
+
+    params = search_params(term)
+    # All keys starting with `prefix` are in [prefix, prefix_end)
+    prefix = key.rstrip('*')
+    prefix_end = (prefix[:-1] + chr(min(ord(prefix[-1]) + 1, 0x10ffff))
+                  if prefix else '')
+    params.update(prefix=prefix, prefix_end=prefix_end, limit=limit)
+    return conn.execute("""
+        SELECT lexentry, written_rep, sense_list, trans_list
+        FROM ({candidates})
+            JOIN translation USING (written_rep)
+        ORDER BY
+            written_key >= :prefix AND written_key < :prefix_end DESC,
+            written_length,
+            lexentry, coalesce(min_sense_num, '99'), rank DESC
+        LIMIT :limit
+    """.format(candidates=search_candidates_query(conn)), params).fetchall()
+
+
+def search_index_bench(conn, lang_pair, samples=200):
+    """ Compare size and query latency of the fts4 and fts5 search indexes
+
+    Both indexes are built into temporary dbs from the translations of the
+    current pair and queried with exact and prefix searches for the most
+    important headwords.
+    """
+    import os
+    import tempfile
+    import time
+
+    terms = [t for (t,) in conn.execute("""
+        SELECT written_rep FROM main.translation
+        WHERE length(written_rep) > 3
+        GROUP BY written_rep
+        ORDER BY max(importance) DESC LIMIT ?
+    """, [samples])]
+    terms += [t[:3] + '*' for t in terms]
+    print()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for index_type in ['fts4', 'fts5']:
+            path = os.path.join(tmp_dir, index_type + '.sqlite3')
+            conn.execute("ATTACH DATABASE ? AS bench", [path])
+            start = time.perf_counter()
+            make_search_index(conn, lang_pair, index_type, schema='bench')
+            conn.commit()
+            build_time = time.perf_counter() - start
+
+            query = search_candidates[index_type].format(
+                schema='bench', table='search_trans')
+            timings = []
+            for t in terms:
+                start = time.perf_counter()
+                conn.execute(query, search_params(t)).fetchall()
+                timings.append(time.perf_counter() - start)
+            timings.sort()
+            conn.execute("DETACH DATABASE bench")
+            print('{}: {:6.1f} MB, built in {:.1f}s, '
+                  'query p50 {:.2f}ms p99 {:.2f}ms'.format(
+                      index_type, os.path.getsize(path) / 1e6, build_time,
+                      timings[len(timings) // 2] * 1000,
+                      timings[int(len(timings) * 0.99)] * 1000))
+
+
+def lookup_bench(conn, lang_pair, samples=2000):
+    """ Measure headword lookup latency in the serving tables
+
+    Only uses columns present in all layouts of the tables, so that dbs from
+    before and after layout changes can be compared.
+    """
+    import time
+
+    # Every n-th headword, so that each run looks up the same terms
+    headwords = [t for (t,) in conn.execute("""
+        SELECT DISTINCT written_rep FROM main.translation
+        ORDER BY written_rep
+    """)]
+    terms = headwords[::max(len(headwords) // samples, 1)][:samples]
+    queries = [
+        ('translation', """
+            SELECT lexentry, written_rep, sense_list, trans_list
+            FROM main.translation
+            WHERE written_rep = ?
+            ORDER BY lexentry, min_sense_num
+        """),
+        ('simple_translation', """
+            SELECT written_rep, trans_list
+            FROM main.simple_translation
+            WHERE written_rep = ?
+        """),
+    ]
+    print()
+    for table, query in queries:
+        timings = []
+        for t in terms:
+            start = time.perf_counter()
+            conn.execute(query, [t]).fetchall()
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        print('{}: p50 {:.3f}ms p99 {:.3f}ms'.format(
+            table,
+            timings[len(timings) // 2] * 1000,
+            timings[int(len(timings) * 0.99)] * 1000))
 
 
 def update_stats(conn, lang_pair):
@@ -190,18 +467,34 @@ def vacuum(conn, lang):
     conn.execute('VACUUM')
 
 
-def do(lang, only, sql, **kwargs):
+fuzzy_index_targets = {
+    'spellfix1': ('spellfix', make_spellfix),
+    'deletion': ('fuzzy', make_fuzzy_index),
+}
+
+
+def do(lang, only, sql, fuzzy, search_index, fts5_detail, **kwargs):
     if '-' not in lang:
+        def make_configured_form_search_index(conn, lang):
+            make_form_search_index(conn, lang, search_index, fts5_detail)
+
         attach = []
         targets = [
             ('vocable', make_vocable),
             ('display', make_display),
             ('entry', make_entry),
+            fuzzy_index_targets[fuzzy],
+            ('form_search_index', make_configured_form_search_index),
+            ('analyze', analyze),
             ('vacuum', vacuum),
         ]
         in_path = 'processed'
     else:
         (from_lang, to_lang) = lang.split('-')
+
+        def make_configured_search_index(conn, lang_pair):
+            make_search_index(conn, lang_pair, search_index, fts5_detail)
+
         attach = [
             "'dictionaries/generic/%s-%s.sqlite3' AS other_pair" % (
                 to_lang, from_lang),
@@ -212,7 +505,8 @@ def do(lang, only, sql, **kwargs):
         targets = [
             ('translation', make_translation),
             ('simple_translation', make_simple_translation),
-            ('search_index', make_search_index),
+            ('search_index', make_configured_search_index),
+            ('analyze', analyze),
             ('vacuum', vacuum),
             ('stats', update_stats),
         ]
@@ -223,16 +517,51 @@ def do(lang, only, sql, **kwargs):
         in_path=in_path,
         out_path='wdweb',
         attach=attach,
+        outputs=['wikdict'],
         targets=targets,
         only=only,
         sql=sql,
+        sources=['src/views.sql'],
+        config=dict(fuzzy=fuzzy, search_index=search_index,
+                    fts5_detail=fts5_detail),
+    )
+
+
+def bench(lang, only, **kwargs):
+    make_targets(
+        lang,
+        in_path='generic',
+        out_path='wdweb',
+        targets=[
+            ('search_index', search_index_bench),
+            ('lookup', lookup_bench),
+        ],
+        only=only,
+        check_manifest=False,
     )
 
 
 def add_subparsers(subparsers):
     process = subparsers.add_parser(
         'wdweb', help='generate lang db for wikdict-web')
-    process.add_argument('lang')
+    process.add_argument('lang', nargs='+')
     process.set_defaults(func=do)
     process.add_argument('--only')
     process.add_argument('--sql')
+    process.add_argument(
+        '--fuzzy', choices=sorted(fuzzy_index_targets), default='spellfix1',
+        help='fuzzy search index for single language dbs')
+    process.add_argument(
+        '--search-index', choices=['fts4', 'fts5'], default='fts4',
+        help='full text search index type')
+    process.add_argument(
+        '--fts5-detail', choices=['full', 'column', 'none'], default='full',
+        help='FTS5 detail level, lower levels give smaller indexes but '
+             'no phrase queries')
+
+    bench_parser = subparsers.add_parser(
+        'wdweb-bench',
+        help='compare search index variants and measure lookup latency')
+    bench_parser.add_argument('lang', nargs='+')
+    bench_parser.add_argument('--only')
+    bench_parser.set_defaults(func=bench)
@@ -1,28 +1,26 @@
-#!/usr/bin/env python
-import sys
+#!/usr/bin/env python3
+""" Load the dbnary dumps of the given languages into Virtuoso
+
+The .ttl.bz2 files are recompressed to .gz in parallel, since virtuoso can
+only load gz. Files which are already up to date are skipped. Afterwards
+several bulk loader workers are run concurrently.
+
+Use `--isql` to use a different isql command, e.g. a stub for testing.
+"""
 import os
+import bz2
+import sys
+import gzip
+import shlex
+import shutil
+import argparse
 from glob import glob
-from subprocess import check_call, Popen, PIPE
+from subprocess import Popen, PIPE
+from concurrent.futures import ThreadPoolExecutor
 
 from languages import language_codes3
 
-os.chdir('ttl')
-lang = sys.argv[1]
-
-# bz2 to gzip, because virtuoso can only load gz
-bz2_files = (
-    glob(lang + '_*.ttl.bz2') +
-    glob(language_codes3[lang] + '_*.ttl.bz2')
-)
-for infile in bz2_files:
-    print infile
-    outfile = infile.replace('.bz2', '.gz')
-    cmd = 'bzcat {} | gzip > {}'.format(infile, outfile)
-    check_call(cmd, shell=True)
-
-# call isql to do the actual loading
-print 'load ' + lang
-isql_code = """
+setup_code = """
     -- remove old prefix dcterms, since we want to bind it to 'dct', now (same as kaiko.getalp.org)
     DB.DBA.XML_REMOVE_NS_BY_PREFIX('dcterms', 2);
     -- set namespaces, needs to be only done once, but redoing doesn't do any harm
@@ -43,32 +41,123 @@ isql_code = """
     DB.DBA.XML_SET_NS_DECL ('rdf', 'http://www.w3.org/1999/02/22-rdf-syntax-ns#', 2);
     DB.DBA.XML_SET_NS_DECL ('xs', 'http://www.w3.org/2001/XMLSchema#', 2);
 
+    DELETE FROM DB.DBA.LOAD_LIST;
+"""
+
+lang_setup_code = """
     -- set namespace for current language
     DB.DBA.XML_SET_NS_DECL('dbnary-%(lang3)s',
                            'http://kaiko.getalp.org/dbnary/%(lang3)s', 2);
 
-    -- clea old data
+    -- clear old data
     SPARQL CLEAR GRAPH <http://kaiko.getalp.org/dbnary/%(lang3)s>;
-    DELETE FROM DB.DBA.LOAD_LIST;
 
     -- add files to load_list
     ld_dir('%(dir)s', '%(lang)s_*.ttl.gz', 'http://kaiko.getalp.org/dbnary/%(lang3)s');
     ld_dir('%(dir)s', '%(lang3)s_*.ttl.gz', 'http://kaiko.getalp.org/dbnary/%(lang3)s');
-    SELECT * FROM DB.DBA.LOAD_LIST;
+"""
 
-    -- load
+loader_code = """
     rdf_loader_run();
+    EXIT;
+"""
 
+finish_code = """
     -- commit
     checkpoint;
     commit WORK;
     checkpoint;
+
+    -- show failed files
+    SELECT ll_file, ll_error FROM DB.DBA.LOAD_LIST WHERE ll_error IS NOT NULL;
     EXIT;
-""" % dict(lang=lang, lang3=language_codes3[lang], dir='/ttl')
-p = Popen(('docker exec -i wikdict-virtuoso isql-v'
-          ).split(' '), stdin=PIPE)
-p.communicate(input=isql_code)
-if p.returncode:
-    print 'isql failed'
-else:
-    print 'success'
+"""
+
+
+def recompress(infile):
+    """ bz2 to gzip, because virtuoso can only load gz """
+    outfile = infile.replace('.bz2', '.gz')
+    if (os.path.exists(outfile)
+            and os.path.getmtime(outfile) >= os.path.getmtime(infile)):
+        print('up to date', outfile, flush=True)
+        return
+    # write to temporary file, so that aborted runs don't leave a complete
+    # looking output. Errors from reading the bz2 file are raised here,
+    # unlike the exit status of bzcat in a shell pipeline.
+    tmp_file = outfile + '.tmp'
+    try:
+        with bz2.open(infile, 'rb') as f_in, \
+                gzip.open(tmp_file, 'wb', compresslevel=6) as f_out:
+            shutil.copyfileobj(f_in, f_out, 1 << 20)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+    os.replace(tmp_file, outfile)
+    print('recompressed', outfile, flush=True)
+
+
+def prepare(ttl_dir, langs, jobs):
+    bz2_files = []
+    for lang in langs:
+        bz2_files += (
+            glob(os.path.join(ttl_dir, lang + '_*.ttl.bz2')) +
+            glob(os.path.join(ttl_dir, language_codes3[lang] + '_*.ttl.bz2'))
+        )
+    with ThreadPoolExecutor(jobs) as pool:
+        # list() to raise exceptions from the workers
+        list(pool.map(recompress, bz2_files))
+
+
+def start_isql(isql, code):
+    p = Popen(shlex.split(isql), stdin=PIPE)
+    p.stdin.write(code.encode())
+    p.stdin.close()
+    return p
+
+
+def run_isql(isql, code):
+    return start_isql(isql, code).wait()
+
+
+def load(isql, langs, loaders, server_dir='/ttl'):
+    print('load ' + ' '.join(langs))
+    code = setup_code + ''.join(
+        lang_setup_code % dict(lang=lang, lang3=language_codes3[lang],
+                               dir=server_dir)
+        for lang in langs
+    ) + "SELECT * FROM DB.DBA.LOAD_LIST;\nEXIT;\n"
+    if run_isql(isql, code):
+        return False
+
+    # Each rdf_loader_run() takes files from the load list until it is
+    # empty, so running several of them in parallel loads files concurrently.
+    processes = [start_isql(isql, loader_code) for _ in range(loaders)]
+    if any([p.wait() for p in processes]):
+        return False
+
+    return run_isql(isql, finish_code) == 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('langs', nargs='+', metavar='lang')
+    parser.add_argument('--ttl-dir', default='ttl',
+                        help='local directory containing the ttl files')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(),
+                        help='number of files recompressed in parallel')
+    parser.add_argument('--loaders', type=int, default=4,
+                        help='number of concurrent rdf_loader_run() calls')
+    parser.add_argument('--isql', default='docker exec -i wikdict-virtuoso isql-v')
+    args = parser.parse_args()
+
+    prepare(args.ttl_dir, args.langs, args.jobs)
+    if load(args.isql, args.langs, args.loaders):
+        print('success')
+    else:
+        print('isql failed')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()